@@ -4,52 +4,792 @@ from datetime import datetime, timedelta
 from collections import defaultdict
 import json
 import csv
+import io
+import os
+import argparse
+import functools
+import glob
+import sqlite3
+from fractions import Fraction
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from yei_cctp_rollup import SECONDS_PER_DAY, AMOUNT_SCALE, FEE_SPLIT
+from yei_cctp_sketches import SketchStore
+from yei_cctp_metrics import metrics
+
+
+# 分析实际用到的列及其类型：只读取这些列（不读取最大的 id 列），低基数字符串读为 category，时间戳读为 int64。
+# 金额和手续费为整数列（amount 为 1e-6 USD，fee / fee_gas 为 native token 最小单位，18 位精度时可能超出 int64，
+# 按字符串读入后拆成两个 int64）；旧版导出文件只有小数列 amount_usd / fee_native / fee_gas_native，
+# 读入后由 normalize_* 换算为整数列
+TRANSFERS_DTYPES = {
+    "chain": "category",
+    "from": str,
+    "type": "category",
+    "amount": "int64",
+    "amount_usd": "float64",
+    "blockTimestamp": "int64"
+}
+GAS_DTYPES = {
+    "chain": "category",
+    "native_symbol": "category",
+    "fee": str,
+    "fee_gas": str,
+    "decimals": "int64",
+    "fee_native": "float64",
+    "fee_gas_native": "float64",
+    "blockTimestamp": "int64"
+}
+LEGACY_FEE_DECIMALS = 12  # 旧版导出文件的手续费保留 12 位小数
+
+# 旧版文件中与新列对应的小数列：惰性加载某一列时一并请求，文件中有哪一列就读哪一列
+LEGACY_COLUMNS = {"amount": "amount_usd", "fee": "fee_native", "fee_gas": "fee_gas_native"}
+TABLE_DTYPES = {"transfers": TRANSFERS_DTYPES, "gas": GAS_DTYPES}
+# 手续费统计用到的 gas 表列
+FEE_SOURCE_COLUMNS = ["chain", "native_symbol", "fee", "fee_gas", "decimals"]
+
+# 持久化的地址字典文件：每个地址 20 字节，地址 ID 即其序号
+ADDRESS_TABLE_FILE = "address_table.bin"
+MISSING_ADDRESS = -1  # 缺少 from（空值）的行的地址 ID，按地址分组时不计入
+
+# 导出脚本的增量水位文件（yei_cctp_export.STATE_FILE），用于判断草图是否与数据同步
+EXPORT_STATE_FILE = "export_state.json"
+
+# 时间粒度及其标签列名（按天的标签沿用原来的 date 列名）
+TIME_GRANULARITIES = {
+    "hour": "hour",
+    "day": "date",
+    "week": "week",
+    "month": "month"
+}
+
+
+def is_parquet(path):
+    return path.endswith(".parquet") or os.path.isdir(path)
+
+
+def parquet_files(path):
+    """Parquet 数据集中的文件，按文件名排序（导出脚本按 CHAINS 顺序加了前缀）"""
+    return sorted(glob.glob(os.path.join(path, "*.parquet"))) if os.path.isdir(path) else [path]
+
+
+def available_dtypes(path, dtypes):
+    """只保留文件中实际存在的列（如早期数据没有 from 列），缺失的列由分析方法自行提示"""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        names = pq.read_schema(parquet_files(path)[0]).names
+    else:
+        names = pd.read_csv(path, nrows=0).columns
+    return {column: dtype for column, dtype in dtypes.items() if column in names}
+
+
+def table_columns(table):
+    """表的逻辑列（不含旧版小数列），即惰性加载时可以请求的列"""
+    return [column for column in TABLE_DTYPES[table] if column not in LEGACY_COLUMNS.values()]
+
+
+def project_dtypes(dtypes, columns):
+    """列投影：只保留 columns 及其对应的旧版小数列"""
+    wanted = set(columns) | {LEGACY_COLUMNS[column] for column in columns if column in LEGACY_COLUMNS}
+    return {column: dtype for column, dtype in dtypes.items() if column in wanted}
+
+
+def read_table(path, dtypes):
+    """读取 CSV 文件或 Parquet 数据集（目录或 .parquet 文件），只取 dtypes 中的列并按给定类型解析"""
+    dtypes = available_dtypes(path, dtypes)
+    columns = list(dtypes)
+    if is_parquet(path):
+        df = pd.read_parquet(path, columns=columns).astype(dtypes)
+        # Parquet 字典按出现顺序排列，统一为排序后的类别，使 groupby 结果顺序与 CSV 一致
+        for column, dtype in dtypes.items():
+            if dtype == "category":
+                df[column] = df[column].cat.reorder_categories(sorted(df[column].cat.categories))
+        return df
+    return pd.read_csv(path, usecols=columns, dtype=dtypes)
+
+
+class FileRange(io.RawIOBase):
+    """只读取文件 [start, end) 字节范围的类文件对象，供 read_csv 读取 CSV 的一个分区"""
+    
+    def __init__(self, path, start, end):
+        super().__init__()
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = end - start
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        n = self._file.readinto(memoryview(buffer)[:size])
+        self._remaining -= n
+        return n
+    
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def table_partitions(path, parts):
+    """把表划分为可独立读取的分区 (文件, 字节范围)：Parquet 数据集每个文件（即每条链）一个分区，
+    字节范围为 None；CSV 按字节大致均分为 parts 段，边界对齐到行首"""
+    if is_parquet(path):
+        return [(filename, None) for filename in parquet_files(path)]
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        bounds = [len(f.readline())]
+        for i in range(1, parts):
+            f.seek(max(bounds[-1], size * i // parts))
+            f.readline()
+            bounds.append(f.tell())
+        bounds.append(size)
+    return [(path, (start, end)) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def iter_partition_chunks(partition, dtypes, chunksize=None):
+    """分块读取一个分区，每块最多 chunksize 行（None 表示整个分区一块）。
+    分块之间的类别集合不同，category 列改按字符串读取，便于合并各块的分组结果"""
+    path, byte_range = partition
+    dtypes = {column: (str if dtype == "category" else dtype)
+              for column, dtype in available_dtypes(path, dtypes).items()}
+    columns = list(dtypes)
+    if byte_range is None:
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize or parquet_file.metadata.num_rows or 1, columns=columns):
+            yield batch.to_pandas().astype(dtypes)
+        return
+    names = pd.read_csv(path, nrows=0).columns
+    with FileRange(path, *byte_range) as f:
+        chunks = pd.read_csv(f, header=None, names=names, usecols=columns, dtype=dtypes, chunksize=chunksize)
+        if chunksize:
+            yield from chunks
+        else:
+            yield chunks
+
+
+def iter_table_chunks(path, dtypes, chunksize):
+    """分块读取 CSV 文件或 Parquet 数据集，每块最多 chunksize 行"""
+    for partition in table_partitions(path, 1):
+        yield from iter_partition_chunks(partition, dtypes, chunksize)
+
+
+def time_buckets(timestamps, granularity):
+    """由 int64 的 blockTimestamp（UTC 秒）直接计算整数时间桶键，不生成逐行的日期对象：
+    hour/day 为 1970-01-01 起的小时数/天数，week 为该 ISO 周周一的天数，month 为 1970-01 起的月数"""
+    seconds = np.asarray(timestamps, dtype='int64')
+    if granularity == 'hour':
+        return seconds // 3600
+    days = seconds // 86400
+    if granularity == 'day':
+        return days
+    if granularity == 'week':
+        return days - (days + 3) % 7  # 1970-01-01 为周四
+    if granularity == 'month':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype('int64')
+    raise ValueError(f"未知的时间粒度: {granularity}")
+
+
+def bucket_labels(keys, granularity):
+    """把时间桶键转换为可读标签（只对不同的键转换一次）：
+    2025-01-22 13:00 / 2025-01-22 / 2025-W04 / 2025-01"""
+    keys = np.asarray(keys, dtype='int64')
+    if granularity == 'hour':
+        return list(pd.to_datetime(keys * 3600, unit='s').strftime('%Y-%m-%d %H:00'))
+    if granularity == 'day':
+        return list(np.datetime_as_string(keys.astype('datetime64[D]')))
+    if granularity == 'week':
+        return list(pd.to_datetime(keys, unit='D').strftime('%G-W%V'))
+    if granularity == 'month':
+        return list(np.datetime_as_string(keys.astype('datetime64[M]')))
+    raise ValueError(f"未知的时间粒度: {granularity}")
+
+
+def to_micros(amount_usd):
+    """USD 金额换算为 1e-6 USD 的整数（USDC 精度为 6 位小数）"""
+    return np.rint(amount_usd * AMOUNT_SCALE).astype('int64')
+
+
+def normalize_transfers(df):
+    """金额统一为 amount 列（1e-6 USD 整数）：旧版文件由 amount_usd 换算（原值即 6 位小数，换算无误差）。
+    整数求和与顺序、分块无关，一次性聚合与分块聚合因此得到完全相同的总额和均值"""
+    if 'amount' not in df.columns and 'amount_usd' in df.columns:
+        df['amount'] = to_micros(df.pop('amount_usd'))
+    return df
+
+
+def split_units(values):
+    """最小单位的整数（十进制字符串，可能超出 int64）拆成 高位（÷FEE_SPLIT）和 低位 两个 int64 数组"""
+    digits = len(str(FEE_SPLIT)) - 1
+    hi = values.str[:-digits].replace('', '0').astype('int64').to_numpy()
+    lo = values.str[-digits:].astype('int64').to_numpy()
+    return hi, lo
+
+
+def normalize_gas(df):
+    """手续费统一为 fee_hi / fee_lo / fee_gas_hi / fee_gas_lo（最小单位 = 高位 * FEE_SPLIT + 低位）和 decimals 列：
+    新版文件拆分 fee / fee_gas 字符串，旧版文件按 12 位小数换算"""
+    for legacy, column in (('fee_native', 'fee'), ('fee_gas_native', 'fee_gas')):
+        if column in df.columns:
+            df[column + '_hi'], df[column + '_lo'] = split_units(df.pop(column).astype(str))
+        elif legacy in df.columns:
+            units = np.rint(df.pop(legacy).to_numpy() * 10 ** LEGACY_FEE_DECIMALS).astype('int64')
+            df[column + '_hi'], df[column + '_lo'] = np.divmod(units, FEE_SPLIT)
+            df['decimals'] = LEGACY_FEE_DECIMALS
+    return df
+
+
+def amount_totals(micros, key):
+    """按 key 分组的转账次数和金额合计（1e-6 USD 整数），可直接相加合并。
+    按编码后的地址分组时，地址 ID 为 MISSING_ADDRESS 的行与空值一样不计入"""
+    if key.name == 'from' and pd.api.types.is_integer_dtype(key):
+        present = key.to_numpy() != MISSING_ADDRESS
+        micros, key = micros[present], key[present]
+    return micros.groupby(key, observed=True).agg(['count', 'sum'])
+
+
+FEE_COLUMNS = ['fee_hi', 'fee_lo', 'fee_gas_hi', 'fee_gas_lo']
+
+
+def fee_totals(gas):
+    """按 (chain, native_symbol, decimals) 分组的手续费合计：高位和低位各自以 int64 求和（不会溢出），可直接相加合并"""
+    return gas.groupby(['chain', 'native_symbol', 'decimals'], observed=True)[FEE_COLUMNS].sum()
+
+
+def fee_stats_frame(totals):
+    """由 fee_totals 的结果合成精确的整数合计，再换算为 native token：(chain, native_symbol) 索引，
+    fee_native / fee_gas_native 列（只在这里转为浮点数）"""
+    rows = defaultdict(lambda: [Fraction(0), Fraction(0)])
+    for (chain, native_symbol, decimals), row in totals.iterrows():
+        for i, column in enumerate(('fee', 'fee_gas')):
+            units = int(row[column + '_hi']) * FEE_SPLIT + int(row[column + '_lo'])
+            rows[(chain, native_symbol)][i] += Fraction(units, 10 ** int(decimals))
+    index = pd.MultiIndex.from_tuples(list(rows), names=['chain', 'native_symbol'])
+    stats = pd.DataFrame([[float(fee), float(gas)] for fee, gas in rows.values()], index=index,
+                         columns=['fee_native', 'fee_gas_native'])
+    return stats.sort_index()
+
+
+def amount_stats_frame(totals, by):
+    """由 amount_totals 的结果得到与 groupby(by).agg({'amount_usd': ['count', 'sum', 'mean']}) 结构相同的表"""
+    totals = totals.sort_index()
+    count = totals['count'].astype('int64')
+    total = totals['sum'].astype('int64') / AMOUNT_SCALE
+    stats = pd.concat({'amount_usd': pd.DataFrame({'count': count, 'sum': total, 'mean': total / count})}, axis=1)
+    stats.index.name = by
+    return stats
+
+
+class PartialAggregates:
+    """可合并的部分聚合：按链、地址和各时间粒度累计转账次数和金额，按 (链, native_symbol) 累计手续费。
+    每个数据块各自 update，块与块之间用 merge 合并，内存只与分组数有关，与行数无关"""
+    
+    def __init__(self):
+        self.amounts = {}      # {分组列: DataFrame(index=分组值, columns=[count, sum])}，sum 单位为 1e-6 USD
+        self.fees = None       # fee_totals 的结果：DataFrame(index=(chain, native_symbol, decimals), columns=[fee_hi, ...])
+        self.chain_order = []  # 各链首次出现的顺序，与整表 unique() 一致
+        self.gas_rows = 0
+    
+    @classmethod
+    def from_rollup(cls, path):
+        """由导出脚本维护的汇总库（yei_cctp_rollup）构造部分聚合，只读取已按 链×天×地址 汇总的行。
+        汇总库的最小时间粒度为天，因此没有 hour 维度"""
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"汇总库不存在: {path}")
+        partials = cls()
+        with closing(sqlite3.connect(path)) as connection:
+            chains = pd.read_sql_query(
+                "SELECT chain, SUM(transfer_count) AS count, SUM(amount_micros) AS sum FROM transfer_rollup "
+                "GROUP BY chain ORDER BY MIN(rowid)", connection)
+            days = pd.read_sql_query(
+                "SELECT day, SUM(transfer_count) AS count, SUM(amount_micros) AS sum FROM transfer_rollup "
+                "GROUP BY day", connection)
+            senders = pd.read_sql_query(
+                "SELECT sender, SUM(transfer_count) AS count, SUM(amount_micros) AS sum FROM transfer_rollup "
+                "WHERE sender != '' GROUP BY sender", connection)
+            fees = pd.read_sql_query(
+                "SELECT chain, native_symbol, decimals, SUM(fee_count) AS rows, SUM(fee_hi) AS fee_hi, "
+                "SUM(fee_lo) AS fee_lo, SUM(fee_gas_hi) AS fee_gas_hi, SUM(fee_gas_lo) AS fee_gas_lo "
+                "FROM fee_rollup GROUP BY chain, native_symbol, decimals", connection)
+        
+        partials.chain_order = list(chains['chain'])
+        partials.amounts['chain'] = chains.set_index('chain')
+        days = days.set_index('day')
+        partials.amounts['day'] = days
+        for granularity in ('week', 'month'):
+            partials.amounts[granularity] = days.groupby(time_buckets(days.index * SECONDS_PER_DAY, granularity)).sum()
+        if len(senders):
+            partials.amounts['from'] = senders.set_index('sender')
+        partials.fees = fees.set_index(['chain', 'native_symbol', 'decimals']).drop(columns='rows')
+        partials.gas_rows = int(fees['rows'].sum())
+        return partials
+    
+    @staticmethod
+    def _add(total, part):
+        if total is None:
+            return part
+        if part is None:
+            return total
+        # 先按并集对齐并以 0 填充，整数列全程保持 int64（直接 add(fill_value=0) 会经过浮点数）
+        index = total.index.union(part.index)
+        return total.reindex(index, fill_value=0) + part.reindex(index, fill_value=0)
+    
+    def update_transfers(self, chunk):
+        chunk = normalize_transfers(chunk)
+        keys = {'chain': chunk['chain']}
+        for granularity in TIME_GRANULARITIES:
+            keys[granularity] = pd.Series(time_buckets(chunk['blockTimestamp'], granularity), index=chunk.index)
+        if 'from' in chunk.columns:
+            keys['from'] = chunk['from']
+        micros = chunk['amount']
+        for name, key in keys.items():
+            part = amount_totals(micros, key.rename(name))
+            self.amounts[name] = self._add(self.amounts.get(name), part)
+        self._add_chains(chunk['chain'].unique())
+    
+    def update_gas(self, chunk):
+        self.fees = self._add(self.fees, fee_totals(normalize_gas(chunk)))
+        self.gas_rows += len(chunk)
+    
+    def merge(self, other):
+        for name, part in other.amounts.items():
+            self.amounts[name] = self._add(self.amounts.get(name), part)
+        self.fees = self._add(self.fees, other.fees)
+        self.gas_rows += other.gas_rows
+        self._add_chains(other.chain_order)
+        return self
+    
+    def _add_chains(self, chains):
+        for chain in chains:
+            if chain not in self.chain_order:
+                self.chain_order.append(chain)
+    
+    @property
+    def total_transfers(self):
+        return int(self.amounts['chain']['count'].sum()) if 'chain' in self.amounts else 0
+    
+    @property
+    def total_amount_usd(self):
+        return int(self.amounts['chain']['sum'].sum()) / AMOUNT_SCALE if 'chain' in self.amounts else 0.0
+    
+    def amount_stats(self, by):
+        if by not in self.amounts:
+            raise ValueError(f"部分聚合中没有按 {by} 的统计")
+        return amount_stats_frame(self.amounts[by], by)
+    
+    def fee_stats(self):
+        return fee_stats_frame(self.fees)
+
+
+def aggregate_partition(table, partition, chunksize=None):
+    """读取一个分区并返回它的部分聚合（进程池任务，须为模块级函数）"""
+    partials = PartialAggregates()
+    if table == 'transfers':
+        for chunk in iter_partition_chunks(partition, TRANSFERS_DTYPES, chunksize):
+            partials.update_transfers(chunk)
+    else:
+        for chunk in iter_partition_chunks(partition, GAS_DTYPES, chunksize):
+            partials.update_gas(chunk)
+    return partials
+
+
+def aggregate_tables(transfers_file, gas_file, chunksize=None, workers=1):
+    """把两张表切成分区分别聚合，再按分区顺序合并为一个 PartialAggregates。
+    workers > 1 时各分区在进程池中并行聚合：Parquet 数据集按链（每链一个文件）划分，CSV 按行段划分。
+    文件为 None 的表不读取（惰性加载时只聚合用到的表）"""
+    tasks = []
+    if transfers_file:
+        tasks += [('transfers', partition) for partition in table_partitions(transfers_file, workers)]
+    if gas_file:
+        tasks += [('gas', partition) for partition in table_partitions(gas_file, workers)]
+    tables, partitions = zip(*tasks)
+    task = functools.partial(aggregate_partition, chunksize=chunksize)
+    
+    partials = PartialAggregates()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for result in executor.map(task, tables, partitions):
+                partials.merge(result)
+    else:
+        for result in map(task, tables, partitions):
+            partials.merge(result)
+    return partials
+
+
+class AddressTable:
+    """地址字典：把 0x 开头的十六进制地址编码为稠密的整数 ID，按 20 字节二进制持久化到文件。
+    新地址追加在文件末尾，已有地址的 ID 不会改变；path 为 None 时只在内存中使用"""
+    
+    def __init__(self, path=ADDRESS_TABLE_FILE):
+        self.path = path
+        if path and os.path.exists(path):
+            self.addresses = np.fromfile(path, dtype='S20')
+        else:
+            self.addresses = np.empty(0, dtype='S20')
+        self._sorted = None  # 查找用的 (排序下标, 排序后的地址)，新增地址后重建
+    
+    def __len__(self):
+        return len(self.addresses)
+    
+    def encode(self, hex_addresses):
+        """把地址序列编码为 int32 ID 数组（每个不同的地址只解析一次），新地址写入字典文件；
+        空值和空字符串（缺少 from）编码为 MISSING_ADDRESS"""
+        values = np.asarray(hex_addresses, dtype=object)
+        codes, uniques = pd.factorize(np.where(values == '', None, values))
+        binary = np.array([bytes.fromhex(address[2:]) for address in uniques], dtype='S20')
+        ids = self.find(binary)
+        
+        # 新地址按首次出现的顺序追加
+        missing = ids < 0
+        new = binary[missing]
+        ids[missing] = np.arange(len(self.addresses), len(self.addresses) + len(new))
+        if len(new):
+            self.addresses = np.concatenate([self.addresses, new])
+            self._sorted = None
+            if self.path:
+                with open(self.path, 'ab') as f:
+                    f.write(new.tobytes())
+        result = np.full(len(codes), MISSING_ADDRESS, dtype='int32')
+        present = codes >= 0
+        result[present] = ids[codes[present]]
+        return result
+    
+    def find(self, binary):
+        """在排序后的字典中二分查找 20 字节地址，返回 ID 数组，不存在的地址为 -1（不修改字典）"""
+        ids = np.full(len(binary), -1, dtype='int32')
+        if len(self.addresses):
+            if self._sorted is None:
+                order = np.argsort(self.addresses, kind='stable')
+                self._sorted = (order, self.addresses[order])
+            order, sorted_addresses = self._sorted
+            positions = np.minimum(np.searchsorted(sorted_addresses, binary), len(order) - 1)
+            found = sorted_addresses[positions] == binary
+            ids[found] = order[positions[found]]
+        return ids
+    
+    def lookup(self, hex_address):
+        """单个十六进制地址的 ID，不在字典中时返回 None"""
+        address_id = self.find(np.array([bytes.fromhex(hex_address.lower()[2:])], dtype='S20'))[0]
+        return int(address_id) if address_id >= 0 else None
+    
+    def decode(self, ids):
+        """把 ID 还原为 0x 开头的十六进制地址（S20 会去掉末尾的零字节，需补齐）"""
+        return ['0x' + address.ljust(20, b'\0').hex() for address in self.addresses[np.asarray(ids)]]
+    
+    def order(self, ids):
+        """按地址字典序排列这些 ID 的下标，用于保持与按十六进制地址分组相同的行顺序"""
+        return np.argsort(self.addresses[np.asarray(ids)], kind='stable')
+
+
+def cached(method):
+    """缓存无参方法的结果（存放在 self._cache 中，load_data 重新加载数据时清空）"""
+    @functools.wraps(method)
+    def wrapper(self):
+        if method.__name__ not in self._cache:
+            self._cache[method.__name__] = method(self)
+        return self._cache[method.__name__]
+    return wrapper
+
+
+def requires(when=None, **tables):
+    """声明方法用到的表和列，如 @requires(transfers=['chain', 'amount'])：调用前由 require 加载尚未加载的列。
+    when(analyzer) 为假时不需要这些列（如草图模式下的用户维度分析不读原始数据）。
+    声明保存在 requirements / requires_when 属性上，多个报表一起运行时可先按并集一次读取（见 CCTPAnalyzer.prepare）"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            for table, columns in method_requirements(wrapper, self).items():
+                self.require(table, columns)
+            return method(self, *args, **kwargs)
+        wrapper.requirements = tables
+        wrapper.requires_when = when
+        return wrapper
+    return decorator
+
+
+def method_requirements(method, analyzer):
+    """方法在该分析器上实际用到的 {表: 列}（见 requires），未声明时为空"""
+    when = getattr(method, 'requires_when', None)
+    if when is not None and not when(analyzer):
+        return {}
+    return getattr(method, 'requirements', {})
 
 
 class CCTPAnalyzer:
-    def __init__(self, transfers_file="all_chains_transfers.csv", gas_file="all_chains_gas.csv"):
-        """初始化分析器"""
+    def __init__(self, transfers_file="all_chains_transfers.csv", gas_file="all_chains_gas.csv",
+                 chunksize=None, workers=1, address_table=ADDRESS_TABLE_FILE, rollup_file=None, sketch_file=None,
+                 lazy=False, state_file=EXPORT_STATE_FILE):
+        """初始化分析器，数据文件可以是 CSV 或导出脚本 --parquet 生成的 Parquet 数据集。
+        指定 chunksize 时使用分块模式：不保留原始行，只保留可合并的部分聚合，内存与分组数成正比；
+        workers > 1 时各分区在多个进程中并行聚合后合并，结果与单进程相同；
+        指定 rollup_file 时直接从导出脚本维护的汇总库出报表，不读取原始数据；
+        指定 sketch_file 时用户维度分析改用导出脚本维护的草图给出近似结果（与 state_file 的导出水位不一致时提示草图已过期）；
+        lazy 为 True 时不在初始化时加载，各报表方法按声明的列（@requires）在首次用到时读取，已读取的列跨报表复用"""
         self.transfers_file = transfers_file
         self.gas_file = gas_file
+        self.chunksize = chunksize
+        self.workers = workers
+        self.address_table = address_table
+        self.rollup_file = rollup_file
+        self.sketches = self._load_sketches(sketch_file, state_file) if sketch_file else None
+        self.addresses = None
         self.transfers_df = None
         self.gas_df = None
-        self.load_data()
+        self.partials = None
+        self._cache = {}
+        self._loaded = {table: set() for table in TABLE_DTYPES}  # 各表已加载的逻辑列
+        if lazy:
+            self.addresses = AddressTable(address_table)
+        else:
+            self.load_data()
     
+    @staticmethod
+    def _load_sketches(sketch_file, state_file):
+        """读取草图文件（不存在时报错，而不是当作空草图），打印草图水位；导出水位文件存在且与草图记录的水位不同时警告"""
+        if not os.path.exists(sketch_file):
+            raise FileNotFoundError(f"草图文件不存在: {sketch_file}")
+        sketches = SketchStore.load(sketch_file)
+        marks = sketches.watermark()
+        print(f"草图水位: {', '.join(f'{chain} {mark}' for chain, mark in marks.items()) or '未知'}")
+        if state_file and os.path.exists(state_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state != sketches.state:
+                print(f"警告: 草图与导出水位 {state_file} 不一致，结果可能已过期（用导出脚本 --sketches 更新）")
+        return sketches
+    
+    @property
+    def partial_mode(self):
+        return bool(self.rollup_file or self.chunksize or self.workers > 1)
+    
+    @metrics.instrument
     def load_data(self):
-        """加载数据"""
+        """加载数据（同时清空聚合缓存）"""
+        self._cache = {}
+        self.addresses = AddressTable(self.address_table)
+        self.partials = None
+        if self.partial_mode:
+            return self._load_partials()
         try:
-            self.transfers_df = pd.read_csv(self.transfers_file)
-            self.gas_df = pd.read_csv(self.gas_file)
+            self.transfers_df = normalize_transfers(read_table(self.transfers_file, TRANSFERS_DTYPES))
+            self.gas_df = normalize_gas(read_table(self.gas_file, GAS_DTYPES))
             
-            # 转换时间戳为日期
-            self.transfers_df['date'] = pd.to_datetime(self.transfers_df['blockTimestamp'], unit='s').dt.date
-            self.gas_df['date'] = pd.to_datetime(self.gas_df['blockTimestamp'], unit='s').dt.date
+            # 地址编码为整数 ID，用户维度的分组都在 ID 上进行
+            if 'from' in self.transfers_df.columns:
+                self.transfers_df['from'] = self.addresses.encode(self.transfers_df['from'])
+            self._loaded = {table: set(table_columns(table)) for table in TABLE_DTYPES}
             
+            timestamps = self.transfers_df['blockTimestamp']
+            start_date, end_date = bucket_labels(time_buckets([timestamps.min(), timestamps.max()], 'day'), 'day')
             print(f"成功加载数据:")
             print(f"- 转账记录: {len(self.transfers_df):,} 条")
             print(f"- Gas费用记录: {len(self.gas_df):,} 条")
-            print(f"- 数据时间范围: {self.transfers_df['date'].min()} 到 {self.transfers_df['date'].max()}")
+            print(f"- 数据时间范围: {start_date} 到 {end_date}")
+            metrics.emit("load", mode="memory", transfers_rows=len(self.transfers_df), gas_rows=len(self.gas_df),
+                         transfers_bytes=int(self.transfers_df.memory_usage(deep=True).sum()),
+                         gas_bytes=int(self.gas_df.memory_usage(deep=True).sum()))
+            
+        except Exception as e:
+            print(f"加载数据失败: {e}")
+            raise
+    
+    def _load_partials(self, tables=tuple(TABLE_DTYPES)):
+        """汇总库/分块/并行模式：读取 tables 中的表（或汇总库）并累计部分聚合，不保留原始行。
+        部分聚合按表整体计算，惰性加载时不做列投影；汇总库总是一次读取两张表的汇总"""
+        try:
+            if self.rollup_file:
+                tables = tuple(TABLE_DTYPES)
+                partials = PartialAggregates.from_rollup(self.rollup_file)
+            else:
+                partials = aggregate_tables(self.transfers_file if 'transfers' in tables else None,
+                                            self.gas_file if 'gas' in tables else None, self.chunksize, self.workers)
+            if 'from' in partials.amounts:
+                totals = partials.amounts['from']
+                totals.index = pd.Index(self.addresses.encode(totals.index), name='from')
+            self.partials = partials if self.partials is None else self.partials.merge(partials)
+            for table in tables:
+                self._loaded[table] = set(table_columns(table))
+            
+            if self.rollup_file:
+                modes = [f"汇总库 {self.rollup_file}"]
+            else:
+                modes = []
+                if self.chunksize:
+                    modes.append(f"每块 {self.chunksize:,} 行")
+                if self.workers > 1:
+                    modes.append(f"{self.workers} 个进程")
+            lines = []
+            if 'transfers' in tables:
+                lines.append(f"- 转账记录: {partials.total_transfers:,} 条")
+            if 'gas' in tables:
+                lines.append(f"- Gas费用记录: {partials.gas_rows:,} 条")
+            if 'transfers' in tables:
+                days = partials.amounts['day'].index
+                start_date, end_date = bucket_labels([days.min(), days.max()], 'day')
+                lines.append(f"- 数据时间范围: {start_date} 到 {end_date}")
+            print(f"成功加载数据（部分聚合模式，{'，'.join(modes)}）:")
+            print("\n".join(lines))
+            metrics.emit("load", mode="partials", tables=list(tables), transfers_rows=partials.total_transfers,
+                         gas_rows=partials.gas_rows, rollup=bool(self.rollup_file), chunksize=self.chunksize,
+                         workers=self.workers)
             
         except Exception as e:
             print(f"加载数据失败: {e}")
             raise
     
+    def require(self, table, columns):
+        """惰性加载：读取 table（transfers / gas）中尚未加载的列，按行拼接到已加载的列上，聚合缓存保留。
+        文件中不存在的列（如早期数据没有 from 列）同样记为已加载，由分析方法自行提示"""
+        missing = [column for column in columns if column not in self._loaded[table]]
+        if not missing:
+            return
+        if self.partial_mode:
+            return self._load_partials((table,))
+        
+        path = self.transfers_file if table == 'transfers' else self.gas_file
+        dtypes = available_dtypes(path, project_dtypes(TABLE_DTYPES[table], missing))
+        if not dtypes:
+            self._loaded[table].update(missing)
+            return
+        try:
+            df = read_table(path, dtypes)
+            if table == 'transfers':
+                df = normalize_transfers(df)
+                if 'from' in df.columns:
+                    df['from'] = self.addresses.encode(df['from'])
+            else:
+                df = normalize_gas(df)
+            current = self.transfers_df if table == 'transfers' else self.gas_df
+            if current is not None:
+                df = pd.concat([current, df], axis=1)
+            if table == 'transfers':
+                self.transfers_df = df
+            else:
+                self.gas_df = df
+            self._loaded[table].update(missing)
+            
+            print(f"成功加载数据（列: {', '.join(missing)}）:")
+            if table == 'transfers':
+                print(f"- 转账记录: {len(df):,} 条")
+                if 'blockTimestamp' in missing:
+                    timestamps = df['blockTimestamp']
+                    start_date, end_date = bucket_labels(time_buckets([timestamps.min(), timestamps.max()], 'day'), 'day')
+                    print(f"- 数据时间范围: {start_date} 到 {end_date}")
+            else:
+                print(f"- Gas费用记录: {len(df):,} 条")
+            metrics.emit("load", mode="lazy", table=table, columns=missing, rows=len(df),
+                         bytes=int(df.memory_usage(deep=True).sum()))
+            
+        except Exception as e:
+            print(f"加载数据失败: {e}")
+            raise
+    
+    def prepare(self, methods):
+        """按多个报表方法声明的列的并集预先加载，每张表只读取一次（逐个报表惰性加载会多次读取同一文件）"""
+        needed = defaultdict(list)
+        for method in methods:
+            for table, columns in method_requirements(method, self).items():
+                needed[table] += [column for column in columns if column not in needed[table]]
+        if self.partial_mode:
+            # 部分聚合模式下两张表的分区放进同一个进程池一起聚合
+            tables = tuple(table for table, columns in needed.items() if not self._loaded[table].issuperset(columns))
+            if tables:
+                self._load_partials(tables)
+            return
+        for table, columns in needed.items():
+            self.require(table, columns)
+    
+    def amount_stats(self, by):
+        """按 by 分组的转账次数、总金额、平均金额（未取整，带缓存）。
+        by 可以是列名，也可以是 TIME_GRANULARITIES 中的时间粒度（索引为整数时间桶键）"""
+        key = ('amount_stats', by)
+        if key not in self._cache:
+            if self.partials is not None:
+                self._cache[key] = self.partials.amount_stats(by)
+            else:
+                if by in TIME_GRANULARITIES:
+                    keys = pd.Series(time_buckets(self.transfers_df['blockTimestamp'], by), index=self.transfers_df.index)
+                else:
+                    keys = self.transfers_df[by]
+                totals = amount_totals(self.transfers_df['amount'], keys)
+                self._cache[key] = amount_stats_frame(totals, by)
+            if by == 'from':
+                stats = self._cache[key]
+                self._cache[key] = stats.iloc[self.addresses.order(stats.index)]
+        return self._cache[key]
+    
+    def bucket_stats(self, granularity):
+        """按时间粒度（hour/day/week/month）的转账次数、总金额、平均金额，索引为可读的时间标签"""
+        key = ('bucket_stats', granularity)
+        if key not in self._cache:
+            stats = self.amount_stats(granularity).copy()
+            stats.index = pd.Index(bucket_labels(stats.index, granularity), name=TIME_GRANULARITIES[granularity])
+            self._cache[key] = stats
+        return self._cache[key]
+    
+    @cached
+    def fee_stats(self):
+        """按 (链, native_symbol) 的手续费合计，以整数精确累计后换算为 native token（未取整，带缓存）"""
+        if self.partials is not None:
+            return self.partials.fee_stats()
+        return fee_stats_frame(fee_totals(self.gas_df))
+    
+    def chains(self):
+        """数据中出现的链，按首次出现的顺序"""
+        if self.partials is not None:
+            return list(self.partials.chain_order)
+        return list(self.transfers_df['chain'].unique())
+    
+    def has_addresses(self):
+        """数据中是否包含用户地址（from 列）"""
+        if self.partials is not None:
+            return 'from' in self.partials.amounts
+        return 'from' in self.transfers_df.columns
+    
+    @cached
+    def _basic_stats(self):
+        """基础统计的计算部分，打印与导出摘要共用"""
+        # 总转账统计
+        if self.partials is not None:
+            total_transfers = self.partials.total_transfers
+            total_amount_usd = self.partials.total_amount_usd
+        else:
+            total_transfers = len(self.transfers_df)
+            total_amount_usd = int(self.transfers_df['amount'].sum()) / AMOUNT_SCALE
+        average_amount = total_amount_usd / total_transfers
+        
+        # 手续费统计（按链分别统计，因为单位不同）
+        fee_stats = self.fee_stats().reset_index()
+        
+        # 按链统计
+        chain_stats = self.amount_stats('chain').round(2)
+        chain_stats.columns = ['转账次数', '总金额(USD)', '平均金额(USD)']
+        
+        return {
+            'total_transfers': total_transfers,
+            'total_amount_usd': total_amount_usd,
+            'average_amount': average_amount,
+            'chain_stats': chain_stats,
+            'fee_stats': fee_stats
+        }
+    
+    @metrics.instrument
+    @requires(transfers=['chain', 'amount'], gas=FEE_SOURCE_COLUMNS)
     def basic_statistics(self):
         """任务1: 基础统计分析"""
         print("\n" + "="*60)
         print("任务 1: 基础统计分析")
         print("="*60)
         
-        # 总转账统计
-        total_transfers = len(self.transfers_df)
-        total_amount_usd = self.transfers_df['amount_usd'].sum()
-        average_amount = self.transfers_df['amount_usd'].mean()
-        
-        # 手续费统计（按链分别统计，因为单位不同）
-        fee_stats = self.gas_df.groupby(['chain', 'native_symbol']).agg({
-            'fee_native': 'sum',
-            'fee_gas_native': 'sum'
-        }).reset_index()
+        stats = self._basic_stats()
+        total_transfers = stats['total_transfers']
+        total_amount_usd = stats['total_amount_usd']
+        average_amount = stats['average_amount']
+        fee_stats = stats['fee_stats']
+        chain_stats = stats['chain_stats']
         
         print(f"1. 总转账统计:")
         print(f"   - 总转账次数: {total_transfers:,}")
@@ -61,47 +801,40 @@ class CCTPAnalyzer:
             total_fee = row['fee_native'] + row['fee_gas_native']
             print(f"   - {row['chain']}: {total_fee:.8f} {row['native_symbol']} (fee: {row['fee_native']:.8f} + gas: {row['fee_gas_native']:.8f})")
         
-        # 按链统计
-        chain_stats = self.transfers_df.groupby('chain').agg({
-            'amount_usd': ['count', 'sum', 'mean']
-        }).round(2)
-        chain_stats.columns = ['转账次数', '总金额(USD)', '平均金额(USD)']
-        
         print(f"\n3. 各链统计:")
         print(chain_stats.to_string())
         
-        return {
-            'total_transfers': total_transfers,
-            'total_amount_usd': total_amount_usd,
-            'average_amount': average_amount,
-            'chain_stats': chain_stats,
-            'fee_stats': fee_stats
-        }
+        return stats
     
+    @metrics.instrument
+    @requires(when=lambda analyzer: analyzer.sketches is None, transfers=['from', 'amount'])
     def user_analysis(self):
         """用户维度分析"""
         print("\n" + "="*60)
         print("任务 1: 用户维度分析")
         print("="*60)
         
+        if self.sketches is not None:
+            return self._sketch_user_analysis()
+        
         # 检查是否有用户地址数据
-        if 'from' not in self.transfers_df.columns:
+        if not self.has_addresses():
             print("警告: 数据中缺少用户地址信息，无法进行用户维度分析")
             print("请重新运行数据收集脚本以获取完整数据")
             return None
         
         # 按用户统计转账次数
-        user_transfer_counts = self.transfers_df.groupby('from').agg({
-            'amount_usd': ['count', 'sum', 'mean']
-        }).round(2)
+        user_transfer_counts = self.amount_stats('from').round(2)
         user_transfer_counts.columns = ['转账次数', '总金额(USD)', '平均金额(USD)']
         user_transfer_counts = user_transfer_counts.sort_values('转账次数', ascending=False)
         
         # 转账次数最多的前10个地址
         top_10_by_count = user_transfer_counts.head(10)
+        top_10_by_count.index = self.addresses.decode(top_10_by_count.index)
         
         # 转账金额最大的前10个地址
         top_10_by_amount = user_transfer_counts.sort_values('总金额(USD)', ascending=False).head(10)
+        top_10_by_amount.index = self.addresses.decode(top_10_by_amount.index)
         
         # 计算平均每个用户的转账次数
         total_users = len(user_transfer_counts)
@@ -140,18 +873,36 @@ class CCTPAnalyzer:
             'whale_users': whale_users
         }
     
-    def time_analysis(self):
-        """时间维度分析"""
-        print("\n" + "="*60)
-        print("任务 1: 时间维度分析")
-        print("="*60)
+    def _sketch_user_analysis(self):
+        """草图模式的用户维度分析：去重用户数为 HyperLogLog 估计，头部地址为 Space-Saving 估计（附真实值范围）"""
+        total_users, relative_error = self.sketches.distinct_users()
+        top_10_by_count = self.sketches.top_senders(10, 'count')
+        top_10_by_amount = self.sketches.top_senders(10, 'amount')
         
+        print(f"1. 用户统计概览（草图估计）:")
+        print(f"   - 总用户数: 约 {total_users:,} (相对标准误差 {relative_error:.1%})")
+        
+        print(f"\n2. 转账次数最多的前10个地址（估计值，括号内为真实值范围）:")
+        for i, (address, estimate, lower, upper) in enumerate(top_10_by_count, 1):
+            print(f"   {i:2d}. {address[:10]}...{address[-8:]}: {estimate:.0f}次 ({lower:.0f} ~ {upper:.0f})")
+        
+        print(f"\n3. 转账金额最大的前10个地址（估计值，括号内为真实值范围）:")
+        for i, (address, estimate, lower, upper) in enumerate(top_10_by_amount, 1):
+            print(f"   {i:2d}. {address[:10]}...{address[-8:]}: ${estimate:,.2f} (${lower:,.2f} ~ ${upper:,.2f})")
+        
+        return {
+            'total_users': total_users,
+            'total_users_relative_error': relative_error,
+            'top_10_by_count': top_10_by_count,
+            'top_10_by_amount': top_10_by_amount
+        }
+    
+    @cached
+    def _time_stats(self):
+        """时间维度统计的计算部分，打印与导出摘要共用"""
         # 按日期统计
-        daily_stats = self.transfers_df.groupby('date').agg({
-            'amount_usd': ['count', 'sum', 'mean']
-        }).round(2)
+        daily_stats = self.bucket_stats('day').round(2)
         daily_stats.columns = ['转账次数', '总金额(USD)', '平均金额(USD)']
-        daily_stats = daily_stats.sort_index()
         
         # 找出最活跃的日期
         most_active_date = daily_stats['转账次数'].idxmax()
@@ -164,27 +915,10 @@ class CCTPAnalyzer:
         avg_daily_transfers = daily_stats['转账次数'].mean()
         avg_daily_amount = daily_stats['总金额(USD)'].mean()
         
-        print(f"1. 时间统计:")
-        print(f"   - 数据天数: {len(daily_stats)} 天")
-        print(f"   - 转账最活跃日期: {most_active_date} ({most_active_count:.0f} 笔)")
-        print(f"   - 金额最高日期: {highest_volume_date} (${highest_volume_amount:,.2f})")
-        print(f"   - 日均转账次数: {avg_daily_transfers:.1f} 笔")
-        print(f"   - 日均转账金额: ${avg_daily_amount:,.2f}")
-        
-        print(f"\n2. 最近10天统计:")
-        print(daily_stats.tail(10).to_string())
-        
         # 按月统计
-        monthly_stats = self.transfers_df.copy()
-        monthly_stats['month'] = pd.to_datetime(monthly_stats['blockTimestamp'], unit='s').dt.to_period('M')
-        monthly_summary = monthly_stats.groupby('month').agg({
-            'amount_usd': ['count', 'sum', 'mean']
-        }).round(2)
+        monthly_summary = self.bucket_stats('month').round(2)
         monthly_summary.columns = ['转账次数', '总金额(USD)', '平均金额(USD)']
         
-        print(f"\n3. 按月统计:")
-        print(monthly_summary.to_string())
-        
         return {
             'daily_stats': daily_stats,
             'most_active_date': most_active_date,
@@ -196,53 +930,90 @@ class CCTPAnalyzer:
             'monthly_stats': monthly_summary
         }
     
+    @metrics.instrument
+    @requires(transfers=['amount', 'blockTimestamp'])
+    def time_analysis(self):
+        """时间维度分析"""
+        print("\n" + "="*60)
+        print("任务 1: 时间维度分析")
+        print("="*60)
+        
+        stats = self._time_stats()
+        daily_stats = stats['daily_stats']
+        most_active_date = stats['most_active_date']
+        most_active_count = stats['most_active_count']
+        highest_volume_date = stats['highest_volume_date']
+        highest_volume_amount = stats['highest_volume_amount']
+        avg_daily_transfers = stats['avg_daily_transfers']
+        avg_daily_amount = stats['avg_daily_amount']
+        monthly_summary = stats['monthly_stats']
+        
+        print(f"1. 时间统计:")
+        print(f"   - 数据天数: {len(daily_stats)} 天")
+        print(f"   - 转账最活跃日期: {most_active_date} ({most_active_count:.0f} 笔)")
+        print(f"   - 金额最高日期: {highest_volume_date} (${highest_volume_amount:,.2f})")
+        print(f"   - 日均转账次数: {avg_daily_transfers:.1f} 笔")
+        print(f"   - 日均转账金额: ${avg_daily_amount:,.2f}")
+        
+        print(f"\n2. 最近10天统计:")
+        print(daily_stats.tail(10).to_string())
+        
+        print(f"\n3. 按月统计:")
+        print(monthly_summary.to_string())
+        
+        return stats
+    
+    @metrics.instrument
+    @requires(transfers=['amount', 'blockTimestamp'])
     def export_daily_stats(self, filename="daily_transfer_stats.csv"):
         """导出每日转账统计表"""
-        daily_stats = self.transfers_df.groupby('date').agg({
-            'amount_usd': ['count', 'sum', 'mean']
-        }).round(6)
+        daily_stats = self.bucket_stats('day').round(6)
         daily_stats.columns = ['transfer_count', 'total_amount_usd', 'average_amount_usd']
         daily_stats = daily_stats.reset_index()
-        daily_stats['date'] = daily_stats['date'].astype(str)
         
         daily_stats.to_csv(filename, index=False)
         print(f"已导出每日统计表: {filename}")
         return daily_stats
     
+    @metrics.instrument
+    @requires(transfers=['from', 'amount'])
     def export_user_rankings(self, filename="active_users_ranking.csv"):
         """导出活跃用户排行榜"""
-        if 'from' not in self.transfers_df.columns:
+        if not self.has_addresses():
             print("警告: 数据中缺少用户地址信息，无法导出用户排行榜")
             return None
             
-        user_stats = self.transfers_df.groupby('from').agg({
-            'amount_usd': ['count', 'sum', 'mean']
-        }).round(6)
+        user_stats = self.amount_stats('from').round(6)
         user_stats.columns = ['transfer_count', 'total_amount_usd', 'average_amount_usd']
         user_stats = user_stats.reset_index()
         user_stats = user_stats.sort_values('transfer_count', ascending=False)
+        user_stats['from'] = self.addresses.decode(user_stats['from'])
         
         user_stats.to_csv(filename, index=False)
         print(f"已导出用户排行榜: {filename}")
         return user_stats
     
+    @metrics.instrument
+    @requires(transfers=['chain', 'amount', 'blockTimestamp'], gas=FEE_SOURCE_COLUMNS)
     def export_summary_report(self, filename="analysis_summary.json"):
-        """导出分析摘要报告"""
-        basic_stats = self.basic_statistics()
-        time_stats = self.time_analysis()
+        """导出分析摘要报告（复用已缓存的统计结果，不重复计算和打印）"""
+        basic_stats = self._basic_stats()
+        time_stats = self._time_stats()
+        daily_stats = self.bucket_stats('day')
+        chain_totals = self.amount_stats('chain')['amount_usd']
         
         summary = {
             "report_generated_at": datetime.now().isoformat(),
             "data_period": {
-                "start_date": str(self.transfers_df['date'].min()),
-                "end_date": str(self.transfers_df['date'].max()),
-                "total_days": len(self.transfers_df['date'].unique())
+                "start_date": str(daily_stats.index.min()),
+                "end_date": str(daily_stats.index.max()),
+                "total_days": len(daily_stats)
             },
             "overall_statistics": {
                 "total_transfers": int(basic_stats['total_transfers']),
                 "total_amount_usd": float(basic_stats['total_amount_usd']),
                 "average_amount_usd": float(basic_stats['average_amount']),
-                "chains_covered": list(self.transfers_df['chain'].unique())
+                "chains_covered": self.chains()
             },
             "time_analysis": {
                 "most_active_date": str(time_stats['most_active_date']),
@@ -256,14 +1027,14 @@ class CCTPAnalyzer:
         }
         
         # 添加各链详细统计
-        for chain in self.transfers_df['chain'].unique():
-            chain_data = self.transfers_df[self.transfers_df['chain'] == chain]
+        for chain in self.chains():
+            chain_row = chain_totals.loc[chain]
             summary["chain_breakdown"][chain] = {
-                "total_transfers": len(chain_data),
-                "total_amount_usd": float(chain_data['amount_usd'].sum()),
-                "average_amount_usd": float(chain_data['amount_usd'].mean()),
-                "percentage_of_total_transfers": float(len(chain_data) / len(self.transfers_df) * 100),
-                "percentage_of_total_volume": float(chain_data['amount_usd'].sum() / self.transfers_df['amount_usd'].sum() * 100)
+                "total_transfers": int(chain_row['count']),
+                "total_amount_usd": float(chain_row['sum']),
+                "average_amount_usd": float(chain_row['mean']),
+                "percentage_of_total_transfers": float(chain_row['count'] / basic_stats['total_transfers'] * 100),
+                "percentage_of_total_volume": float(chain_row['sum'] / basic_stats['total_amount_usd'] * 100)
             }
         
         with open(filename, 'w', encoding='utf-8') as f:
@@ -273,6 +1044,8 @@ class CCTPAnalyzer:
         return summary
     
     
+    @metrics.instrument
+    @requires(transfers=['chain', 'from', 'amount', 'blockTimestamp'], gas=FEE_SOURCE_COLUMNS)
     def run_complete_analysis(self):
         """运行完整分析"""
         print("开始 CCTP Agent 数据分析...")
@@ -314,7 +1087,55 @@ class CCTPAnalyzer:
             'summary': summary
         }
 
+
+# 命令行可单独运行的报表：名称 -> (CCTPAnalyzer 方法名, 说明)。各方法用 @requires 声明用到的列，
+# 只运行部分报表时只读取这些列（如 rankings 只读转账表的 from 和 amount，不读 gas 表）
+REPORTS = {
+    "basic": ("basic_statistics", "基础统计（总量、手续费、各链）"),
+    "time": ("time_analysis", "时间维度分析"),
+    "users": ("user_analysis", "用户维度分析"),
+    "daily": ("export_daily_stats", "导出每日统计表 daily_transfer_stats.csv"),
+    "rankings": ("export_user_rankings", "导出用户排行榜 active_users_ranking.csv"),
+    "summary": ("export_summary_report", "导出分析摘要 analysis_summary.json"),
+    "all": ("run_complete_analysis", "完整分析（默认）")
+}
+
+
 if __name__ == "__main__":
-    # 运行分析
-    analyzer = CCTPAnalyzer()
-    results = analyzer.run_complete_analysis()
+    parser = argparse.ArgumentParser(description="Yei CCTP Agent 数据分析",
+                                     epilog="报表: " + "；".join(f"{name} - {text}" for name, (_, text) in REPORTS.items()))
+    parser.add_argument("reports", nargs="*", metavar="report",
+                        help=f"要运行的报表（{' / '.join(REPORTS)}），可指定多个，按顺序运行且数据只读取一次，默认 all")
+    parser.add_argument("--transfers-file", default="all_chains_transfers.csv",
+                        help="转账主表（CSV 或 Parquet 数据集，如 all_chains_transfers.parquet）")
+    parser.add_argument("--gas-file", default="all_chains_gas.csv",
+                        help="手续费表（CSV 或 Parquet 数据集，如 all_chains_gas.parquet）")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="分块模式：每次读取的行数，内存只与分组数有关（数据超出内存时使用）")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="并行聚合的进程数，大于 1 时按链（Parquet）或行段（CSV）分区并行计算")
+    parser.add_argument("--address-table", default=ADDRESS_TABLE_FILE,
+                        help="持久化的地址字典文件（20 字节二进制地址，地址 ID 即序号）")
+    parser.add_argument("--rollup-file", default=None,
+                        help="直接从导出脚本 --rollup 维护的汇总库（如 cctp_rollup.db）出报表，不扫描原始数据")
+    parser.add_argument("--sketch-file", default=None,
+                        help="用户维度分析改用导出脚本 --sketches 维护的草图（如 cctp_sketches.json）给出近似结果")
+    parser.add_argument("--state-file", default=EXPORT_STATE_FILE,
+                        help="导出脚本的水位文件，与 --sketch-file 的草图水位比对，不一致时提示草图已过期")
+    parser.add_argument("--metrics-file", default=None,
+                        help="以 JSON lines 追加写出结构化指标（加载行数、每个分析 / 导出方法的耗时）")
+    parser.add_argument("--trace-memory", action="store_true", help="用 tracemalloc 记录每个方法的内存分配峰值")
+    parser.add_argument("--profile", default=None, help="对整个分析做 cProfile，结果写入该文件")
+    args = parser.parse_args()
+    unknown = [name for name in args.reports if name not in REPORTS]
+    if unknown:
+        parser.error(f"未知的报表: {', '.join(unknown)}，可选: {', '.join(REPORTS)}")
+    metrics.configure(args.metrics_file, args.trace_memory, args.profile)
+    
+    # 运行分析：惰性加载，只读取所选报表用到的列
+    analyzer = CCTPAnalyzer(args.transfers_file, args.gas_file, args.chunksize, args.workers, args.address_table,
+                            args.rollup_file, args.sketch_file, lazy=True, state_file=args.state_file)
+    methods = [getattr(analyzer, REPORTS[name][0]) for name in args.reports or ["all"]]
+    analyzer.prepare(methods)
+    for method in methods:
+        method()
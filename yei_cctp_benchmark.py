@@ -0,0 +1,266 @@
+import os
+import io
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from yei_cctp_analysis import CCTPAnalyzer, ADDRESS_TABLE_FILE
+from yei_cctp_export import CHAINS, TRANSFERS_FIELDNAMES, GAS_FIELDNAMES, write_parquet_dataset
+
+# ===================== 配置 =====================
+# 合成数据以仓库中的真实数据为基准：1x 的各链行数即 all_chains_transfers.csv 中各链的行数（合计 16,922 行），
+# v2 占比、去重地址比例与之相近
+CHAIN_WEIGHTS = {"ETH": 1141, "BASE": 3217, "AVAX": 1604, "ARB": 5630, "POLYGON": 1947, "OP": 3383}
+BASE_ROWS = sum(CHAIN_WEIGHTS.values())
+DEFAULT_SCALES = [10, 100, 1000]
+V2_SHARE = 0.42              # DepositForBurnV2 事件（带 fee）的占比
+# 地址按 Zipf 分布从地址池中抽取：排名第 k 的地址概率 ∝ k^-s，少数地址贡献大量转账。
+# 默认参数下 1x 约有 11k 个地址、最活跃地址约 100 笔，与真实数据（12,135 个地址，最多 94 笔）接近
+ADDRESS_POOL_RATIO = 2.0     # 地址池大小 / 行数
+ZIPF_EXPONENT = 0.6
+START_TIMESTAMP = 1728000000
+SPAN_SECONDS = 278 * 86400
+GENERATE_CHUNK_ROWS = 1_000_000  # 生成数据时每块的行数，内存与总规模无关
+MAX_FEE_UNITS = 18 * 10 ** 18    # 单笔手续费上限（最小单位），超出 int64 的值也会出现
+DATA_DIR = "benchmark_data"
+RESULTS_FILE = "benchmark_results.json"
+REGRESSION_THRESHOLD = 1.2   # 与基线对比时，耗时超过基线该倍数的步骤标记为回归
+
+# 计时的步骤，按 run_complete_analysis 的顺序执行；各步骤共用分析器的聚合缓存，与实际运行时的代价一致
+STEPS = [
+    ("basic_statistics", lambda analyzer, out_dir: analyzer.basic_statistics()),
+    ("time_analysis", lambda analyzer, out_dir: analyzer.time_analysis()),
+    ("user_analysis", lambda analyzer, out_dir: analyzer.user_analysis()),
+    ("export_daily_stats", lambda analyzer, out_dir: analyzer.export_daily_stats(os.path.join(out_dir, "daily_transfer_stats.csv"))),
+    ("export_user_rankings", lambda analyzer, out_dir: analyzer.export_user_rankings(os.path.join(out_dir, "active_users_ranking.csv"))),
+    ("export_summary_report", lambda analyzer, out_dir: analyzer.export_summary_report(os.path.join(out_dir, "analysis_summary.json")))
+]
+
+# ===================== 合成数据 =====================
+def address_of(rank):
+    """地址池中排名为 rank 的地址（由排名确定性地派生，分块生成时同一排名总是同一地址）"""
+    return "0x" + hashlib.blake2b(int(rank).to_bytes(8, 'big'), digest_size=20).hexdigest()
+
+def zipf_cdf(pool_size, exponent):
+    weights = np.arange(1, pool_size + 1, dtype='float64') ** -exponent
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+def generate_chunk(rng, chain_name, rows, start, end, first_index, cdf, seen):
+    """生成一条链在 [start, end) 时间段内的 rows 行，返回 (转账表, gas 表) 两个 DataFrame"""
+    timestamps = np.sort(rng.integers(start, end, rows))
+    ranks = np.minimum(np.searchsorted(cdf, rng.random(rows)), len(cdf) - 1)
+    seen[ranks] = True
+    unique_ranks, inverse = np.unique(ranks, return_inverse=True)
+    senders = np.array([address_of(rank) for rank in unique_ranks], dtype=object)[inverse]
+
+    is_v2 = rng.random(rows) < V2_SHARE
+    # 金额：多数为几十美元，少数为几十万美元的长尾
+    amounts = np.rint(np.clip(rng.lognormal(np.log(30.0), 2.5, rows), 0.01, 1e6) * 1e6).astype('int64')
+    fees = {}
+    for column in ("fee", "fee_gas"):
+        units = np.clip(rng.lognormal(np.log(1e13), 3.0, rows), 0, MAX_FEE_UNITS)
+        fees[column] = np.where(is_v2, np.rint(units), 0).astype('uint64').astype(str)
+
+    hashes = rng.bytes(32 * rows).hex()
+    ids = [f"{timestamp // 2:015d}:0x{hashes[i * 64:(i + 1) * 64]}:{first_index + i:010d}"
+           for i, timestamp in enumerate(timestamps)]
+    common = {"chain": chain_name, "id": ids, "from": senders, "type": np.where(is_v2, "v2", "v1")}
+    transfers = pd.DataFrame({**common, "amount": amounts, "blockTimestamp": timestamps})
+    gas = pd.DataFrame({**common, "fee": fees["fee"], "fee_gas": fees["fee_gas"],
+                        "decimals": CHAINS[chain_name]["decimals"], "native_symbol": CHAINS[chain_name]["native_symbol"],
+                        "blockTimestamp": timestamps})
+    return transfers[TRANSFERS_FIELDNAMES], gas[GAS_FIELDNAMES]
+
+def generate_dataset(transfers_file, gas_file, scale, seed=0, exponent=ZIPF_EXPONENT):
+    """生成 scale 倍规模的转账表和 gas 表（与导出脚本相同的列和链顺序），分块写出。返回数据集的描述"""
+    rng = np.random.default_rng(seed)
+    total_rows = BASE_ROWS * scale
+    pool_size = max(1, int(total_rows * ADDRESS_POOL_RATIO))
+    cdf = zipf_cdf(pool_size, exponent)
+    seen = np.zeros(pool_size, dtype=bool)
+    weight_total = sum(CHAIN_WEIGHTS.values())
+
+    header = True
+    for chain_name, weight in CHAIN_WEIGHTS.items():
+        chain_rows = total_rows * weight // weight_total
+        chunks = max(1, -(-chain_rows // GENERATE_CHUNK_ROWS))
+        for i in range(chunks):
+            rows = chain_rows * (i + 1) // chunks - chain_rows * i // chunks
+            start = START_TIMESTAMP + SPAN_SECONDS * i // chunks
+            end = START_TIMESTAMP + SPAN_SECONDS * (i + 1) // chunks
+            transfers, gas = generate_chunk(rng, chain_name, rows, start, end, chain_rows * i // chunks, cdf, seen)
+            transfers.to_csv(transfers_file, mode='w' if header else 'a', header=header, index=False)
+            gas.to_csv(gas_file, mode='w' if header else 'a', header=header, index=False)
+            header = False
+
+    return {
+        "scale": scale,
+        "rows": int(sum(total_rows * weight // weight_total for weight in CHAIN_WEIGHTS.values())),
+        "address_pool": pool_size,
+        "distinct_senders": int(seen.sum()),
+        "zipf_exponent": exponent,
+        "seed": seed,
+        "chain_weights": CHAIN_WEIGHTS
+    }
+
+def prepare_dataset(data_dir, scale, seed, exponent, parquet=False):
+    """生成（或复用已生成的）数据集，返回 (转账表路径, gas 表路径, 描述)"""
+    os.makedirs(data_dir, exist_ok=True)
+    prefix = os.path.join(data_dir, f"x{scale}_seed{seed}_zipf{exponent}")
+    transfers_file, gas_file, meta_file = prefix + "_transfers.csv", prefix + "_gas.csv", prefix + ".json"
+    meta = None
+    if os.path.exists(meta_file):
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        # 各链行数比例变化后，旧的数据集不再复用
+        if meta.get("chain_weights") != CHAIN_WEIGHTS:
+            meta = None
+        else:
+            print(f"复用已生成的 {scale}x 数据: {transfers_file}")
+    generated = meta is None
+    if generated:
+        print(f"生成 {scale}x 数据（{BASE_ROWS * scale:,} 行）...")
+        started = time.perf_counter()
+        meta = generate_dataset(transfers_file, gas_file, scale, seed, exponent)
+        meta["generate_seconds"] = round(time.perf_counter() - started, 3)
+        with open(meta_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+    if parquet:
+        transfers_dataset, gas_dataset = prefix + "_transfers.parquet", prefix + "_gas.parquet"
+        if generated or not os.path.exists(transfers_dataset):
+            with redirect_stdout(io.StringIO()):
+                write_parquet_dataset(transfers_file, transfers_dataset)
+                write_parquet_dataset(gas_file, gas_dataset)
+        transfers_file, gas_file = transfers_dataset, gas_dataset
+    meta["transfers_bytes"] = file_size(transfers_file)
+    meta["gas_bytes"] = file_size(gas_file)
+    return transfers_file, gas_file, meta
+
+def file_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+# ===================== 计时与内存 =====================
+def measure(function, trace_memory):
+    """执行 function，返回 (结果, {"seconds", "peak_mb"})。peak_mb 为该步骤内 tracemalloc 记录的分配峰值
+    （不含步骤开始前已占用的内存，也不含子进程）；追踪本身会拖慢执行，因此计时和内存分两轮测量"""
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = function()
+    metrics = {"seconds": time.perf_counter() - started}
+    if trace_memory:
+        metrics["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result, metrics
+
+def run_pass(transfers_file, gas_file, out_dir, analyzer_options, trace_memory):
+    """完整跑一遍 load_data + 各分析步骤，返回 {步骤名: 指标}。每轮使用新的地址字典文件，地址编码按冷启动计"""
+    address_table = os.path.join(out_dir, ADDRESS_TABLE_FILE)
+    if os.path.exists(address_table):
+        os.remove(address_table)
+    steps = {}
+    with redirect_stdout(io.StringIO()):
+        analyzer, steps["load_data"] = measure(
+            lambda: CCTPAnalyzer(transfers_file, gas_file, address_table=address_table, **analyzer_options), trace_memory)
+        for name, step in STEPS:
+            _, steps[name] = measure(lambda: step(analyzer, out_dir), trace_memory)
+    return steps
+
+def benchmark_scale(transfers_file, gas_file, out_dir, analyzer_options, repeat=1, trace_memory=True):
+    """计时取 repeat 轮中的最小值；另跑一轮 tracemalloc 记录各步骤的内存峰值"""
+    os.makedirs(out_dir, exist_ok=True)
+    timings = [run_pass(transfers_file, gas_file, out_dir, analyzer_options, False) for _ in range(repeat)]
+    steps = {name: {"seconds": round(min(run[name]["seconds"] for run in timings), 4)} for name in timings[0]}
+    if trace_memory:
+        for name, metrics in run_pass(transfers_file, gas_file, out_dir, analyzer_options, True).items():
+            steps[name]["peak_mb"] = round(metrics["peak_mb"], 2)
+    steps["total"] = {"seconds": round(sum(metrics["seconds"] for metrics in steps.values()), 4)}
+    return steps
+
+# ===================== 结果 =====================
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(result, baseline=None):
+    """打印一个规模的结果；给出基线时附上耗时比值，超过 REGRESSION_THRESHOLD 的标记为回归"""
+    print(f"\n{result['scale']}x（{result['dataset']['rows']:,} 行，{result['dataset']['distinct_senders']:,} 个地址）:")
+    print(f"  {'步骤':<24}{'耗时(秒)':>12}{'峰值(MB)':>12}{'基线比':>10}")
+    for name, metrics in result["steps"].items():
+        peak = f"{metrics['peak_mb']:,.1f}" if "peak_mb" in metrics else "-"
+        ratio = ""
+        if baseline and name in baseline and baseline[name]["seconds"] > 0:
+            value = metrics["seconds"] / baseline[name]["seconds"]
+            ratio = f"{value:.2f}" + (" 回归" if value > REGRESSION_THRESHOLD else "")
+        print(f"  {name:<24}{metrics['seconds']:>12,.3f}{peak:>12}{ratio:>10}")
+
+def load_baseline(path):
+    """读取之前的结果文件，返回 {规模: {步骤名: 指标}}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {run["scale"]: run["steps"] for run in data["runs"]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CCTPAnalyzer 合成数据基准测试（按倍数放大仓库数据规模）")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help=f"数据规模，相对 {BASE_ROWS:,} 行的倍数")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="合成数据目录，同参数的数据会复用")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--zipf", type=float, default=ZIPF_EXPONENT, help="地址 Zipf 分布的指数，越大越集中")
+    parser.add_argument("--parquet", action="store_true", help="读取由合成 CSV 转换的 Parquet 数据集")
+    parser.add_argument("--chunksize", type=int, default=None, help="传给 CCTPAnalyzer 的分块行数")
+    parser.add_argument("--workers", type=int, default=1, help="传给 CCTPAnalyzer 的并行进程数")
+    parser.add_argument("--repeat", type=int, default=1, help="计时轮数，取最小值")
+    parser.add_argument("--no-memory", action="store_true", help="不做 tracemalloc 内存测量")
+    parser.add_argument("--output", default=RESULTS_FILE, help="结果 JSON 文件")
+    parser.add_argument("--baseline", default=None, help="之前的结果文件，打印各步骤的耗时比值")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+    analyzer_options = {"chunksize": args.chunksize, "workers": args.workers}
+    runs = []
+    for scale in args.scales:
+        transfers_file, gas_file, dataset = prepare_dataset(args.data_dir, scale, args.seed, args.zipf, args.parquet)
+        out_dir = os.path.join(args.data_dir, f"x{scale}_output")
+        steps = benchmark_scale(transfers_file, gas_file, out_dir, analyzer_options, args.repeat, not args.no_memory)
+        runs.append({"scale": scale, "dataset": dataset, "steps": steps})
+        print_results(runs[-1], baseline.get(scale))
+
+    results = {
+        "generated_at": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "environment": {
+            "python": sys.version.split()[0],
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "options": {
+            "format": "parquet" if args.parquet else "csv",
+            "chunksize": args.chunksize,
+            "workers": args.workers,
+            "repeat": args.repeat,
+            "trace_memory": not args.no_memory
+        },
+        "runs": runs
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n已保存基准测试结果: {args.output}")
@@ -1,11 +1,40 @@
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import csv
-from datetime import datetime
+import os
+import sys
+import copy
+import json
+import random
+import shutil
+import glob
+import argparse
+import threading
+from decimal import Decimal
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from yei_cctp_rollup import ROLLUP_FILE, AMOUNT_SCALE, RollupStore
+from yei_cctp_sketches import SKETCH_FILE, HLL_PRECISION, TOP_K_CAPACITY, SketchStore
+from yei_cctp_metrics import metrics
 
 # ===================== 配置 =====================
 PAGE_SIZE = 1000
-DELAY = 2.0  # 防限流延迟（秒），可调大
+# 每个端点独立的令牌桶限流（替代原先全局固定 2 秒 sleep），被限流时可调小
+RATE_LIMIT_RPS = 0.5   # 每秒补充的令牌数，0.5 即平均每 2 秒一个请求
+RATE_LIMIT_BURST = 1   # 令牌桶容量（允许的突发请求数）
+# HTTP 传输：每个端点一个 keep-alive 连接池；429 / 5xx / 超时按指数退避 + 抖动重试，优先遵循 Retry-After
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0     # 首次重试的退避上限（秒），之后每次翻倍
+BACKOFF_MAX = 60.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 可重试的网络错误（响应体读到一半断开也算），其余 requests 异常包装为 SubgraphError
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError)
+POOL_MAXSIZE = 10
 
 # 6 个链的端点和 native token 信息
 CHAINS = {
@@ -41,123 +70,474 @@ CHAINS = {
     }
 }
 
+MAX_WORKERS = len(CHAINS)  # 并发导出时的线程数，默认每条链一个线程
+# 单条链内按 blockTimestamp 切分的时间窗口数及并发数；窗口数可大于并发数，以平衡各窗口的数据量差异。
+# 链内并行的收益受端点限流约束，开启时通常需要同时调高 RATE_LIMIT_RPS / RATE_LIMIT_BURST
+SHARDS_PER_CHAIN = 1
+SHARD_WORKERS = 4
+# 批量模式：把多个窗口 / 实体的分页查询用 GraphQL 别名合并到一次 POST 中。
+# 每批的查询数按响应大小自适应：超过 BATCH_TARGET_BYTES 或触发端点复杂度限制时减半，明显偏小时翻倍
+BATCH_INITIAL_STREAMS = 4
+BATCH_MAX_STREAMS = 32
+BATCH_TARGET_BYTES = 4_000_000
+STATE_FILE = "export_state.json"  # 增量同步的水位文件：每条链、每种实体最后同步到的 id / blockTimestamp
+
+# ===================== 限流 =====================
+class RateLimiter:
+    """令牌桶限流器，每个 Subgraph 端点一个实例，线程安全"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取走一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """服务端要求退避（429 / Retry-After）时清空令牌并透支，使该端点所有线程一起暂停"""
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(chain_info):
+    """按端点获取（或创建）限流器，链配置中可用 rate_limit_rps / rate_limit_burst 单独覆盖"""
+    endpoint = chain_info["endpoint"]
+    with _rate_limiters_lock:
+        if endpoint not in _rate_limiters:
+            _rate_limiters[endpoint] = RateLimiter(
+                chain_info.get("rate_limit_rps", RATE_LIMIT_RPS),
+                chain_info.get("rate_limit_burst", RATE_LIMIT_BURST)
+            )
+        return _rate_limiters[endpoint]
+
+# ===================== HTTP 传输 =====================
+class SubgraphError(Exception):
+    """Subgraph 请求在重试后仍失败，或返回了 GraphQL 错误"""
+
+class GraphQLError(SubgraphError):
+    """端点正常响应但返回了 GraphQL 错误（如查询过于复杂），重试同一查询没有意义"""
+
+class ExportCancelled(SubgraphError):
+    """其他链或窗口导出失败，本任务在两页之间收到停止信号后中止"""
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(endpoint):
+    """按端点复用 Session：保持长连接，避免每页重新进行 TCP/TLS 握手"""
+    with _sessions_lock:
+        if endpoint not in _sessions:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
+            session.headers.update({"Accept-Encoding": "gzip", "Connection": "keep-alive"})
+            _sessions[endpoint] = session
+        return _sessions[endpoint]
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt):
+    """指数退避 + 全抖动：在 [0, min(BACKOFF_MAX, BACKOFF_BASE * 2^attempt)] 内随机"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def chain_of(endpoint):
+    """端点对应的链名，用于指标分组"""
+    return next((name for name, info in CHAINS.items() if info["endpoint"] == endpoint), endpoint)
+
+def post_query(endpoint, query, limiter=None, stats=None):
+    """发送 GraphQL 查询并返回 data 字段；可重试的错误按退避策略重试，其余错误直接抛出 SubgraphError。
+    传入 stats 字典时写入响应字节数 bytes。每次请求（含重试）发出一条 request 指标事件"""
+    session = get_session(endpoint)
+    chain_name = chain_of(endpoint)
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter is not None:
+            limiter.acquire()
+        
+        retry_after = None
+        fatal = None
+        started = time.perf_counter()
+        try:
+            response = session.post(endpoint, json={"query": query}, timeout=REQUEST_TIMEOUT)
+            status, size = response.status_code, len(response.content)
+            error = None
+        except requests.RequestException as e:
+            error = f"{type(e).__name__}: {e}"
+            status, size = None, 0
+            if not isinstance(e, RETRY_EXCEPTIONS):
+                fatal = e
+        latency_ms = round((time.perf_counter() - started) * 1000, 3)
+        metrics.add(chain_name, requests=1, bytes=size, retries=1 if attempt else 0, request_ms=latency_ms)
+        metrics.emit("request", chain=chain_name, attempt=attempt, status=status, latency_ms=latency_ms, bytes=size,
+                     error=error)
+        if fatal is not None:
+            raise SubgraphError(f"{endpoint}: {fatal}") from fatal
+        
+        if error is None:
+            if response.status_code in RETRY_STATUS_CODES:
+                error = f"HTTP {response.status_code}"
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            else:
+                try:
+                    response.raise_for_status()
+                    data = response.json()
+                except (requests.HTTPError, ValueError) as e:
+                    raise SubgraphError(f"{endpoint}: {e}") from e
+                if "errors" in data:
+                    raise GraphQLError(f"{endpoint}: GraphQL 错误 {data['errors']}")
+                if stats is not None:
+                    stats["bytes"] = size
+                return data.get("data") or {}
+        
+        if attempt == MAX_RETRIES:
+            raise SubgraphError(f"{endpoint}: 重试 {MAX_RETRIES} 次后仍失败（{error}）")
+        
+        delay = retry_after if retry_after is not None else backoff_delay(attempt)
+        if retry_after is not None and limiter is not None:
+            limiter.pause(retry_after)
+        print(f"请求失败（{error}），{delay:.1f} 秒后第 {attempt + 1} 次重试")
+        time.sleep(delay)
+
 # ===================== 查询模板 =====================
-QUERY_TEMPLATE = """
-{
-  depositForBurns(first: %d, skip: %d) {
-    id
-    from
-    amount
+# 使用 keyset（游标）分页：按 id 升序，每页以上一页最后一条的 id 作为 id_gt 条件。
+# skip 在 graph-node 上随偏移量变慢且有上限，游标分页每页延迟恒定。
+# id 以零填充的区块号开头，因此 id 顺序即链上时间顺序。
+# 两种事件各自维护游标，某一实体取完后即从查询中移除，不再为它付出请求和传输开销。
+ENTITY_FIELDS = {
+    "depositForBurns": ["id", "from", "amount", "blockTimestamp"],
+    "depositForBurnV2S": ["id", "from", "amount", "fee", "feeForgasOnDestination", "blockTimestamp"],
+}
+
+# 实体 → 输出中的 type 字段
+ENTITY_TYPES = {"depositForBurns": "v1", "depositForBurnV2S": "v2"}
+TYPE_ENTITIES = {tx_type: entity for entity, tx_type in ENTITY_TYPES.items()}
+
+ENTITY_QUERY_TEMPLATE = """
+  %s: %s(first: %d, orderBy: id, orderDirection: asc, where: {%s}) {
+    %s
+  }"""
+
+# 查询水位之后第一条和最后一条事件的时间，用于规划时间窗口
+BOUNDS_QUERY_TEMPLATE = """
+  %s_first: %s(first: 1, orderBy: id, orderDirection: asc, where: {id_gt: "%s"}) {
     blockTimestamp
   }
-  depositForBurnV2S(first: %d, skip: %d) {
-    id
-    from
-    amount
-    fee
-    feeForgasOnDestination
+  %s_last: %s(first: 1, orderBy: id, orderDirection: desc) {
     blockTimestamp
-  }
-}
-"""
+  }"""
 
-def fetch_page(endpoint, skip):
-    query = QUERY_TEMPLATE % (PAGE_SIZE, skip, PAGE_SIZE, skip)
-    try:
-        response = requests.post(endpoint, json={"query": query}, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        
-        if "errors" in data:
-            print(f"GraphQL 错误: {data['errors']}")
-            return [], []
-        
-        burns = data.get("data", {}).get("depositForBurns", [])
-        burns_v2 = data.get("data", {}).get("depositForBurnV2S", [])
-        return burns, burns_v2
+def build_where(cursor, window=None):
+    """游标条件，外加时间窗口 [start, end) 的 blockTimestamp 过滤（None 表示该侧不设界）"""
+    conditions = [f'id_gt: "{cursor}"']
+    start, end = window or (None, None)
+    if start is not None:
+        conditions.append(f'blockTimestamp_gte: "{start}"')
+    if end is not None:
+        conditions.append(f'blockTimestamp_lt: "{end}"')
+    return ", ".join(conditions)
+
+def build_field(alias, entity, cursor, window=None):
+    return ENTITY_QUERY_TEMPLATE % (alias, entity, PAGE_SIZE, build_where(cursor, window), "\n    ".join(ENTITY_FIELDS[entity]))
+
+def build_query(cursors, window=None):
+    """cursors: {实体名: 上一页最后一条的 id}，首页为空字符串；只为传入的实体生成查询"""
+    return "{%s\n}" % "".join(build_field(entity, entity, cursor, window) for entity, cursor in cursors.items())
+
+def fetch_page(endpoint, cursors, limiter=None, window=None):
+    """返回 {实体名: 本页记录列表}；重试后仍失败时抛出 SubgraphError，而不是当作空页"""
+    data = post_query(endpoint, build_query(cursors, window), limiter)
+    return {entity: data.get(entity) or [] for entity in cursors}
+
+def plan_windows(endpoint, watermarks, shards, limiter=None):
+    """把水位之后的历史按 blockTimestamp 等分为至多 shards 个窗口 [start, end)。
+    第一个窗口不设下界（由游标保证从水位之后开始），最后一个窗口不设上界（包含拉取期间新产生的事件）"""
+    if shards <= 1:
+        return [(None, None)]
+    query = "{%s\n}" % "".join(
+        BOUNDS_QUERY_TEMPLATE % (entity, entity, watermarks.get(entity, {}).get("id", ""), entity, entity)
+        for entity in ENTITY_FIELDS
+    )
+    data = post_query(endpoint, query, limiter)
+    firsts = [int(data[f"{entity}_first"][0]["blockTimestamp"]) for entity in ENTITY_FIELDS if data.get(f"{entity}_first")]
+    lasts = [int(data[f"{entity}_last"][0]["blockTimestamp"]) for entity in ENTITY_FIELDS if data.get(f"{entity}_last")]
+    if not firsts:
+        return [(None, None)]
     
-    except Exception as e:
-        print(f"请求失败: {e}")
-        return [], []
+    start, end = min(firsts), max(lasts) + 1
+    step = -(-(end - start) // shards)  # 向上取整
+    bounds = list(range(start, end, step))[1:]
+    return list(zip([None] + bounds, bounds + [None]))
 
-def process_chain(chain_name, chain_info, all_transfers_records, all_gas_records):
-    endpoint = chain_info["endpoint"]
+def initial_cursors(watermarks):
+    """从水位得到各实体的起始游标，没有水位的实体从头开始"""
+    return {entity: watermarks.get(entity, {}).get("id", "") for entity in ENTITY_FIELDS}
+
+def advance_cursors(cursors, watermarks, pages):
+    """用一页结果推进游标和水位（原地更新）；不足一页说明该实体已取完，从后续查询中移除"""
+    for entity, items in pages.items():
+        if items:
+            watermarks[entity] = {"id": items[-1]['id'], "blockTimestamp": items[-1]['blockTimestamp']}
+        if len(items) < PAGE_SIZE:
+            del cursors[entity]
+        else:
+            cursors[entity] = items[-1]['id']
+
+def check_stop(stop, label):
+    """stop（threading.Event）已置位时抛出 ExportCancelled；每页之间调用"""
+    if stop is not None and stop.is_set():
+        raise ExportCancelled(f"{label}: 导出已中止")
+
+def iter_pages(endpoint, watermarks, limiter=None, window=None, stop=None):
+    """按各实体游标逐页拉取，产出 {实体名: 本页记录列表}；watermarks 随每页推进（原地更新）。
+    stop 被置位时在下一页之前中止"""
+    cursors = initial_cursors(watermarks)
+    
+    while cursors:
+        check_stop(stop, endpoint)
+        pages = fetch_page(endpoint, cursors, limiter, window)
+        if not any(pages.values()):
+            return
+        advance_cursors(cursors, watermarks, pages)
+        yield pages
+
+def iter_records(chain_name, chain_info, pages):
+    """把一页原始事件转换为 (转账主表记录, gas 费用表记录)"""
     native_symbol = chain_info["native_symbol"]
     decimals = chain_info["decimals"]
     
-    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 开始处理 {chain_name}...")
-    
-    total_count = 0
-    total_amount_usd = 0.0
-    total_fee_native = 0.0
-    total_fee_gas_native = 0.0
-    
-    skip = 0
-    page = 1
-    
-    while True:
-        burns, burns_v2 = fetch_page(endpoint, skip)
-        
-        page_count = len(burns) + len(burns_v2)
-        if page_count == 0:
-            break
-        
-        for item in burns + burns_v2:
-            total_count += 1
-            
+    for entity, items in pages.items():
+        tx_type = ENTITY_TYPES[entity]
+        for item in items:
             tx_id = item.get('id', '')
             from_address = item.get('from', '')
             timestamp = item.get('blockTimestamp', '')
             
-            # amount → USDC
+            # 金额和手续费保留 Subgraph 的整数原值：amount 为 1e-6 USDC，fee 为 native token 最小单位（10^-decimals），
+            # 换算为 USD / native token 只在输出报表时进行
             amount = int(item.get('amount', 0))
-            amount_usd = amount / 1_000_000.0
             
-            # fee & fee_gas → native token
             # 注意：v1版本的DepositForBurn事件在Subgraph中没有fee字段
             # 只有v2版本的DepositForBurnV2事件才有fee和feeForgasOnDestination字段
             fee_min = int(item.get('fee', 0))
             fee_gas_min = int(item.get('feeForgasOnDestination', 0))
-            fee_native = fee_min / (10 ** decimals)
-            fee_gas_native = fee_gas_min / (10 ** decimals)
-            
-            tx_type = "v2" if 'fee' in item else "v1"
             
             # 1. 转账主表记录
-            all_transfers_records.append({
+            transfer = {
                 "chain": chain_name,
                 "id": tx_id,
                 "from": from_address,
                 "type": tx_type,
-                "amount_usd": amount_usd,
+                "amount": amount,
                 "blockTimestamp": timestamp
-            })
+            }
             
             # 2. gas 费用表记录（只保存有费用的行，或全部保存都行，这里全部保存）
-            all_gas_records.append({
+            gas = {
                 "chain": chain_name,
                 "id": tx_id,
                 "from": from_address,
                 "type": tx_type,
-                "fee_native": fee_native,
-                "fee_gas_native": fee_gas_native,
+                "fee": fee_min,
+                "fee_gas": fee_gas_min,
+                "decimals": decimals,
                 "native_symbol": native_symbol,
                 "blockTimestamp": timestamp
-            })
+            }
+            yield transfer, gas
+
+class WindowExport:
+    """单个时间窗口的输出端：两个分片文件、页计数及数值合计；sketches 不为 None 时每页同时计入草图"""
+    
+    def __init__(self, chain_name, chain_info, index, window, sketches=None):
+        self.chain_name = chain_name
+        self.chain_info = chain_info
+        self.sketches = sketches
+        self.label = chain_name if window == (None, None) else f"{chain_name}#{index}"
+        self.totals = {"count": 0, "pages": 0, "amount": 0, "fee": 0, "fee_gas": 0}
+        self.page = 1
+        self.transfers_sink = CsvPartSink(part_filename(TRANSFERS_FILE, chain_name, index), TRANSFERS_FIELDNAMES)
+        self.gas_sink = CsvPartSink(part_filename(GAS_FILE, chain_name, index), GAS_FIELDNAMES)
+    
+    def write(self, pages):
+        """转换一页记录并直接写入分片，写完即 flush"""
+        page_count = 0
+        transfers = []
+        for transfer, gas in iter_records(self.chain_name, self.chain_info, pages):
+            self.transfers_sink.write(transfer)
+            self.gas_sink.write(gas)
+            transfers.append(transfer)
             
-            total_amount_usd += amount_usd
-            total_fee_native += fee_native
-            total_fee_gas_native += fee_gas_native
-        
-        print(f" 第 {page} 页 | 本页 {page_count} 条 | 累计 {total_count:,} 条")
+            page_count += 1
+            self.totals["amount"] += transfer["amount"]
+            self.totals["fee"] += gas["fee"]
+            self.totals["fee_gas"] += gas["fee_gas"]
         
-        if page_count < PAGE_SIZE:
-            break
+        self.transfers_sink.flush()
+        self.gas_sink.flush()
+        if self.sketches is not None:
+            self.sketches.add_records(transfers)
+        self.totals["count"] += page_count
+        self.totals["pages"] += 1
+        print(f" [{self.label}] 第 {self.page} 页 | 本页 {page_count} 条 | 累计 {self.totals['count']:,} 条")
+        metrics.emit("page", chain=self.chain_name, window=self.label, page=self.page, rows=page_count)
+        self.page += 1
+    
+    def close(self):
+        self.transfers_sink.close()
+        self.gas_sink.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+@metrics.profiled
+def process_window(chain_name, chain_info, index, window, watermarks, limiter, sketches=None, stop=None):
+    """拉取 → 转换 → 写出的流水线：一个时间窗口的记录逐页直接写入它自己的分片，内存占用与历史总量无关"""
+    with WindowExport(chain_name, chain_info, index, window, sketches) as export:
+        for pages in iter_pages(chain_info["endpoint"], watermarks, limiter, window, stop):
+            export.write(pages)
+        return export.totals
+
+def process_windows_batched(chain_name, chain_info, windows, window_watermarks, limiter, sketches=None, stop=None):
+    """批量模式：所有窗口的各实体游标视为独立的流，每次把若干条流的下一页以别名 s0、s1… 合并为一个查询，
+    再把响应拆回各窗口。每批的流数按响应大小和端点的复杂度限制自适应调整"""
+    endpoint = chain_info["endpoint"]
+    batch_size = BATCH_INITIAL_STREAMS
+    batch_limit = BATCH_MAX_STREAMS  # 被端点拒绝过的批量大小不再尝试
+    cursors = [initial_cursors(marks) for marks in window_watermarks]
+    
+    with ExitStack() as stack:
+        exports = [stack.enter_context(WindowExport(chain_name, chain_info, index, window, sketches))
+                   for index, window in enumerate(windows)]
+        while True:
+            # 按窗口顺序取最前面的若干条流，早的窗口先完成
+            streams = [(index, entity) for index in range(len(windows)) for entity in cursors[index]]
+            if not streams:
+                break
+            check_stop(stop, chain_name)
+            batch = streams[:batch_size]
+            query = "{%s\n}" % "".join(
+                build_field(f"s{i}", entity, cursors[index][entity], windows[index])
+                for i, (index, entity) in enumerate(batch)
+            )
+            
+            stats = {}
+            try:
+                data = post_query(endpoint, query, limiter, stats)
+            except GraphQLError as e:
+                if batch_size == 1:
+                    raise
+                batch_size = batch_limit = max(1, batch_size // 2)
+                print(f" [{chain_name}] 批量查询被拒绝，每批降为 {batch_size} 条流: {e}")
+                continue
+            
+            pages_by_window = {}
+            for i, (index, entity) in enumerate(batch):
+                pages_by_window.setdefault(index, {})[entity] = data.get(f"s{i}") or []
+            for index, pages in pages_by_window.items():
+                advance_cursors(cursors[index], window_watermarks[index], pages)
+                if any(pages.values()):
+                    exports[index].write(pages)
+            
+            if stats["bytes"] > BATCH_TARGET_BYTES and batch_size > 1:
+                batch_size = max(1, batch_size // 2)
+            elif stats["bytes"] < BATCH_TARGET_BYTES // 4 and len(batch) == batch_size:
+                batch_size = min(batch_limit, batch_size * 2)
         
-        skip += PAGE_SIZE
-        page += 1
-        time.sleep(DELAY)
+        return [export.totals for export in exports]
+
+def wait_all(futures, stop):
+    """按提交顺序返回全部任务的结果。任一任务失败时立即置位 stop 通知其余任务在下一页之前停止，
+    取消尚未开始的任务，并抛出最先出现的真实错误（而不是其他任务因此抛出的 ExportCancelled）"""
+    done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+    errors = [future.exception() for future in futures if future in done and future.exception() is not None]
+    if errors:
+        stop.set()
+        for future in pending:
+            future.cancel()
+        raise next((error for error in errors if not isinstance(error, ExportCancelled)), errors[0])
+    return [future.result() for future in futures]
+
+@metrics.profiled
+def process_chain(chain_name, chain_info, watermarks=None, shards=SHARDS_PER_CHAIN, shard_workers=SHARD_WORKERS,
+                  batch=False, sketches=None, stop=None):
+    """导出单条链：历史按时间窗口切分后并行（或批量）拉取，每个窗口写入独立分片，合并时按窗口顺序拼接。
+    watermarks: {实体名: {"id", "blockTimestamp"}}，从水位之后开始拉取，完成后推进到最新位置（原地更新）；
+    sketches: 可选的 SketchStore，拉取到的每页记录随即计入；
+    stop: 各链共用的 threading.Event，任一链或窗口失败时置位，其余任务在下一页之前中止"""
+    if watermarks is None:
+        watermarks = {}
+    if stop is None:
+        stop = threading.Event()
+    native_symbol = chain_info["native_symbol"]
+    limiter = get_rate_limiter(chain_info)
+    started = time.monotonic()
+    
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 开始处理 {chain_name}...")
+    
+    try:
+        check_stop(stop, chain_name)
+        windows = plan_windows(chain_info["endpoint"], watermarks, shards, limiter)
+        if len(windows) > 1:
+            mode = "批量查询" if batch else f"并发 {shard_workers}"
+            print(f" [{chain_name}] 按 blockTimestamp 切分为 {len(windows)} 个时间窗口，{mode}")
+        # 每个窗口各自推进一份水位副本，全部完成后取各实体最大的 id
+        window_watermarks = [copy.deepcopy(watermarks) for _ in windows]
+        if batch:
+            results = process_windows_batched(chain_name, chain_info, windows, window_watermarks, limiter, sketches,
+                                              stop)
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, shard_workers)) as executor:
+                futures = [
+                    executor.submit(process_window, chain_name, chain_info, index, window, window_watermarks[index], limiter,
+                                    sketches, stop)
+                    for index, window in enumerate(windows)
+                ]
+                results = wait_all(futures, stop)
+    except ExportCancelled:
+        raise
+    except SubgraphError as e:
+        stop.set()
+        print(f"{chain_name} 导出失败: {e}")
+        raise
+    
+    for marks in window_watermarks:
+        for entity, mark in marks.items():
+            if mark["id"] > watermarks.get(entity, {}).get("id", ""):
+                watermarks[entity] = mark
     
+    total_count = sum(totals["count"] for totals in results)
+    # 合计按整数累加，打印时才换算为 USD / native token
+    total_amount_usd = sum(totals["amount"] for totals in results) / AMOUNT_SCALE
+    total_fee_native = sum(totals["fee"] for totals in results) / 10 ** chain_info["decimals"]
+    total_fee_gas_native = sum(totals["fee_gas"] for totals in results) / 10 ** chain_info["decimals"]
     average_amount = total_amount_usd / total_count if total_count > 0 else 0
     
     stats = {
@@ -167,71 +547,281 @@ def process_chain(chain_name, chain_info, all_transfers_records, all_gas_records
         "total_fee_native": f"{total_fee_native:,.8f}",
         "total_fee_gas_native": f"{total_fee_gas_native:,.8f}",
         "average_amount_usd": f"${average_amount:,.2f}",
-        "native_symbol": native_symbol
+        "native_symbol": native_symbol,
+        "shards": len(windows)
     }
     
     print(f"{chain_name} 完成！总转账次数: {total_count:,} | 总金额: ${total_amount_usd:,.2f}")
+    seconds = time.monotonic() - started
+    metrics.emit("chain", chain=chain_name, rows=total_count, pages=sum(totals["pages"] for totals in results),
+                 shards=len(windows), seconds=round(seconds, 3),
+                 rows_per_second=round(total_count / seconds, 1) if seconds > 0 else None, **metrics.totals(chain_name))
     return stats
 
-def save_transfers_csv(records, filename="all_chains_transfers.csv"):
-    if not records:
-        return
-    fieldnames = ["chain", "id", "from", "type", "amount_usd", "blockTimestamp"]
-    with open(filename, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in records:
-            writer.writerow({
-                "chain": row["chain"],
-                "id": row["id"],
-                "from": row["from"],
-                "type": row["type"],
-                "amount_usd": f"{row['amount_usd']:.6f}",
-                "blockTimestamp": row["blockTimestamp"]
-            })
-    print(f"已保存转账主表：{filename} （{len(records):,} 条）")
-
-def save_gas_csv(records, filename="all_chains_gas.csv"):
-    if not records:
-        return
-    fieldnames = ["chain", "id", "from", "type", "fee_native", "fee_gas_native", "native_symbol", "blockTimestamp"]
-    with open(filename, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+# ===================== 输出 =====================
+TRANSFERS_FILE = "all_chains_transfers.csv"
+GAS_FILE = "all_chains_gas.csv"
+# amount 为 1e-6 USDC 的整数；fee / fee_gas 为 native token 最小单位的整数，decimals 为其精度
+TRANSFERS_FIELDNAMES = ["chain", "id", "from", "type", "amount", "blockTimestamp"]
+GAS_FIELDNAMES = ["chain", "id", "from", "type", "fee", "fee_gas", "decimals", "native_symbol", "blockTimestamp"]
+# 旧版导出文件的小数列（amount_usd 为 USD，fee_native / fee_gas_native 为 native token）及对应的整数列
+LEGACY_COLUMNS = {"amount_usd": "amount", "fee_native": "fee", "fee_gas_native": "fee_gas"}
+
+# 可选的 Parquet 输出（需要 pyarrow）：每个数据集是一个目录，每条链一个 zstd 压缩文件，
+# 文件名带 CHAINS 顺序前缀，按目录读取时行顺序与 CSV 一致；分析脚本可按列、按类型直接读取
+TRANSFERS_PARQUET = "all_chains_transfers.parquet"
+GAS_PARQUET = "all_chains_gas.parquet"
+PARQUET_COMPRESSION = "zstd"
+PARQUET_BLOCK_SIZE = 16 << 20  # 流式读取 CSV 时每批的字节数
+PARQUET_DICTIONARY_COLUMNS = ["chain", "type", "native_symbol"]
+# fee / fee_gas 为最小单位的整数，18 位精度时可能超出 int64（如 12.4 MATIC），按字符串保存
+PARQUET_STRING_COLUMNS = ["id", "from", "fee", "fee_gas"]
+PARQUET_INTEGER_COLUMNS = ["amount", "decimals", "blockTimestamp"]
+
+def upgrade_legacy_row(row):
+    """把旧版导出文件的一行（小数字符串的金额 / 手续费）换算为整数列，按字符串精确换算；新版行原样返回"""
+    if "fee_native" in row:
+        row["decimals"] = CHAINS[row["chain"]]["decimals"]
+    for legacy, column in LEGACY_COLUMNS.items():
+        if legacy in row:
+            scale = AMOUNT_SCALE if column == "amount" else 10 ** row["decimals"]
+            row[column] = int(Decimal(row.pop(legacy)) * scale)
+    return row
+
+class CsvPartSink:
+    """单个时间窗口的 CSV 分片（无表头），每页写完即 flush 落盘；全部链完成后由 merge_parts 按顺序拼接"""
+    
+    def __init__(self, filename, fieldnames):
+        self.filename = filename
+        self.file = open(filename, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+    
+    def write(self, record):
+        self.writer.writerow(record)
+    
+    def flush(self):
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def part_filename(filename, chain_name, index=0):
+    return f"{filename}.{chain_name}.{index:04d}.part"
+
+def part_filenames(filename, all_stats=None):
+    """按链顺序、窗口顺序列出本次导出的全部分片；all_stats 为 None（导出中止，窗口数未知）时列出磁盘上该文件的全部分片"""
+    if all_stats is None:
+        return sorted(glob.glob(glob.escape(filename) + ".*.part"))
+    return [part_filename(filename, stats["chain"], index) for stats in all_stats for index in range(stats["shards"])]
+
+def load_state(filename=STATE_FILE):
+    """读取增量同步水位，文件不存在时返回空状态（即全量同步）"""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state, filename=STATE_FILE):
+    """先写临时文件再替换，避免中途崩溃留下损坏的水位文件"""
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_filename, filename)
+
+def is_superseded(row, start_state):
+    """已有行是否会被本次拉取覆盖：本次从水位之后全部重拉，水位之后的旧行（如上次崩溃残留）一律丢弃。
+    start_state 中不存在的链本次未拉取，其已有行原样保留"""
+    if row["chain"] not in start_state:
+        return False
+    entity = TYPE_ENTITIES[row["type"]]
+    return row["id"] > start_state[row["chain"]].get(entity, {}).get("id", "")
+
+def merge_parts(filename, fieldnames, parts, start_state=None, on_row=None):
+    """把分片按顺序流式拼接为最终 CSV，并删除分片。
+    start_state 不为 None 时为增量合并：保留已有文件中未被本次拉取覆盖的行（按 (chain, id) 去重），
+    旧版文件的行换算为整数列后写入。on_row(row, sign) 用于维护汇总库：被覆盖丢弃的已有行以 -1、新写入的行以 1 回调"""
+    kept = 0
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.DictWriter(out, fieldnames=fieldnames)
         writer.writeheader()
-        for row in records:
-            writer.writerow({
-                "chain": row["chain"],
-                "id": row["id"],
-                "from": row["from"],
-                "type": row["type"],
-                "fee_native": f"{row['fee_native']:.12f}",
-                "fee_gas_native": f"{row['fee_gas_native']:.12f}",
-                "native_symbol": row["native_symbol"],
-                "blockTimestamp": row["blockTimestamp"]
-            })
-    print(f"已保存 gas 费用表：{filename} （{len(records):,} 条）")
+        if start_state is not None and os.path.exists(filename):
+            with open(filename, 'r', newline='', encoding='utf-8') as f:
+                for row in map(upgrade_legacy_row, csv.DictReader(f)):
+                    if not is_superseded(row, start_state):
+                        writer.writerow(row)
+                        kept += 1
+                    elif on_row is not None:
+                        on_row(row, -1)
+        for part_name in parts:
+            with open(part_name, 'r', newline='', encoding='utf-8') as part:
+                shutil.copyfileobj(part, out)
+                if on_row is not None:
+                    part.seek(0)
+                    for row in csv.DictReader(part, fieldnames=fieldnames):
+                        on_row(row, 1)
+    os.replace(tmp_filename, filename)
+    for part_name in parts:
+        os.remove(part_name)
+    return kept
+
+def write_parquet_dataset(csv_filename, dataset_dir):
+    """把合并后的 CSV 流式转换为按链分文件的 Parquet 数据集，内存占用只与每批大小有关。未安装 pyarrow 时返回 False"""
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("写出 Parquet 需要安装 pyarrow：pip install pyarrow")
+        return False
+    
+    column_types = {name: pa.dictionary(pa.int32(), pa.string()) for name in PARQUET_DICTIONARY_COLUMNS}
+    column_types.update({name: pa.string() for name in PARQUET_STRING_COLUMNS})
+    column_types.update({name: pa.int64() for name in PARQUET_INTEGER_COLUMNS})
+    chain_order = list(CHAINS)
+    
+    tmp_dir = dataset_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    writers = {}
+    try:
+        reader = pa_csv.open_csv(
+            csv_filename,
+            read_options=pa_csv.ReadOptions(block_size=PARQUET_BLOCK_SIZE),
+            convert_options=pa_csv.ConvertOptions(column_types=column_types)
+        )
+        for batch in reader:
+            chain_column = pc.cast(batch.column("chain"), pa.string())
+            for chain_name in pc.unique(chain_column).to_pylist():
+                if chain_name not in writers:
+                    index = chain_order.index(chain_name) if chain_name in chain_order else len(chain_order)
+                    path = os.path.join(tmp_dir, f"{index:02d}-{chain_name}.parquet")
+                    writers[chain_name] = pq.ParquetWriter(path, batch.schema, compression=PARQUET_COMPRESSION)
+                writers[chain_name].write_batch(batch.filter(pc.equal(chain_column, chain_name)))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    os.replace(tmp_dir, dataset_dir)
+    print(f"已保存 Parquet 数据集：{dataset_dir} （{len(writers)} 个文件）")
+    return True
+
+def export_chains_sequential(chains, state, **chain_options):
+    """逐条链依次导出；state 为 {链名: 水位}，导出过程中原地推进"""
+    return [process_chain(name, info, state.setdefault(name, {}), **chain_options) for name, info in chains.items()]
+
+def export_chains_concurrent(chains, state, max_workers=MAX_WORKERS, **chain_options):
+    """所有链并发导出，每条链写入各自的分片，结束后按 CHAINS 顺序合并，保证输出顺序与串行一致。
+    任一链失败时通过 chain_options["stop"] 通知其余链停止，不再等它们拉完全部历史"""
+    watermarks = {name: state.setdefault(name, {}) for name in chains}
+    stop = chain_options.setdefault("stop", threading.Event())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_chain, name, info, watermarks[name], **chain_options)
+                   for name, info in chains.items()]
+        return wait_all(futures, stop)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="导出 Yei CCTP Agent 六条链的跨链转账数据")
+    parser.add_argument("--sequential", action="store_true", help="逐条链串行导出（默认所有链并发）")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="并发导出的线程数")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量同步：从水位文件记录的位置继续拉取，并按 id 合并进已有 CSV")
+    parser.add_argument("--state-file", default=STATE_FILE, help="增量同步的水位文件路径")
+    parser.add_argument("--shards", type=int, default=SHARDS_PER_CHAIN,
+                        help="每条链按 blockTimestamp 切分的时间窗口数（1 表示不切分）")
+    parser.add_argument("--shard-workers", type=int, default=SHARD_WORKERS, help="单条链内并发拉取的窗口数")
+    parser.add_argument("--parquet", action="store_true",
+                        help="额外写出按链分文件、zstd 压缩的 Parquet 数据集（需要 pyarrow）")
+    parser.add_argument("--batch", action="store_true",
+                        help="批量模式：用 GraphQL 别名把多个窗口 / 实体的分页合并到一次请求（配合 --shards 使用）")
+    parser.add_argument("--rollup", action="store_true",
+                        help="导出后更新 链×天×地址 预聚合汇总库（增量模式下只应用本次变动）")
+    parser.add_argument("--rollup-file", default=ROLLUP_FILE, help="汇总库（SQLite）路径")
+    parser.add_argument("--sketches", action="store_true",
+                        help="随页流式更新按 链×天 的近似用户指标草图（HyperLogLog 去重数、Space-Saving 头部地址）")
+    parser.add_argument("--sketch-file", default=SKETCH_FILE, help="草图文件路径")
+    parser.add_argument("--sketch-precision", type=int, default=HLL_PRECISION,
+                        help="HyperLogLog 精度 p（2^p 个寄存器，相对误差约 1.04/sqrt(2^p)）")
+    parser.add_argument("--sketch-top-k", type=int, default=TOP_K_CAPACITY,
+                        help="Space-Saving 每个摘要跟踪的地址数（高估不超过 总量/该值）")
+    parser.add_argument("--metrics-file", default=None,
+                        help="以 JSON lines 追加写出结构化指标（每个请求的延迟/字节/重试、每页行数、各链吞吐、各阶段耗时）")
+    parser.add_argument("--trace-memory", action="store_true", help="用 tracemalloc 记录合并等阶段的内存分配峰值")
+    parser.add_argument("--profile", default=None, help="对整个导出做 cProfile，结果写入该文件")
+    return parser.parse_args()
 
 def main():
-    all_stats = []
-    all_transfers_records = []
-    all_gas_records = []
+    args = parse_args()
+    metrics.configure(args.metrics_file, args.trace_memory, args.profile)
+    start_time = time.monotonic()
+    # 全量模式从空水位开始；两种模式结束后都会写出水位，供下一次增量同步使用
+    state = load_state(args.state_file) if args.incremental else {}
+    # 本次拉取的起点：没有水位的链从头重拉，其已有行全部被覆盖
+    start_state = {name: copy.deepcopy(state.get(name, {})) for name in CHAINS} if args.incremental else None
+    
+    # 草图与起点水位一致时随页流式更新；否则（首次使用、全量导出、参数变化）导出后由合并的 CSV 重建
+    sketches = SketchStore.load(args.sketch_file, args.sketch_precision, args.sketch_top_k) if args.sketches else None
+    streaming_sketches = sketches if sketches and start_state is not None and sketches.state == start_state else None
+    
+    chain_options = {"shards": args.shards, "shard_workers": args.shard_workers, "batch": args.batch,
+                     "sketches": streaming_sketches, "stop": threading.Event()}
+    try:
+        with metrics.stage("fetch", sequential=args.sequential, shards=args.shards, batch=args.batch):
+            if args.sequential:
+                all_stats = export_chains_sequential(CHAINS, state, **chain_options)
+            else:
+                all_stats = export_chains_concurrent(CHAINS, state, args.workers, **chain_options)
+    except SubgraphError as e:
+        # 不写出不完整的 CSV，也不推进水位；已有输出保持原样，删除本次写了一半的分片
+        print(f"导出中止: {e}")
+        for part_name in part_filenames(TRANSFERS_FILE) + part_filenames(GAS_FILE):
+            os.remove(part_name)
+        sys.exit(1)
+    
     grand_total_transfers = 0
     grand_total_amount = 0.0
-    
-    for chain_name, chain_info in CHAINS.items():
-        stats = process_chain(chain_name, chain_info, all_transfers_records, all_gas_records)
-        all_stats.append(stats)
-        
+    for stats in all_stats:
         grand_total_transfers += stats["total_transfers"]
         grand_total_amount += float(stats["total_amount_usd"].replace("$", "").replace(",", ""))
     
-    # 保存两个指定的 CSV
-    save_transfers_csv(all_transfers_records)
-    save_gas_csv(all_gas_records)
+    # 合并为两个指定的 CSV；CSV 写完后再推进水位，中途失败时下次会从旧水位重拉并去重
+    rollup = RollupStore(args.rollup_file) if args.rollup else None
+    delta = rollup.begin(start_state) if rollup else None
+    with metrics.stage("merge_transfers"):
+        kept = merge_parts(TRANSFERS_FILE, TRANSFERS_FIELDNAMES, part_filenames(TRANSFERS_FILE, all_stats), start_state,
+                           delta.add_transfer if delta else None)
+    print(f"已保存转账主表：{TRANSFERS_FILE} （新增 {grand_total_transfers:,} 条，共 {kept + grand_total_transfers:,} 条）")
+    with metrics.stage("merge_gas"):
+        kept = merge_parts(GAS_FILE, GAS_FIELDNAMES, part_filenames(GAS_FILE, all_stats), start_state,
+                           delta.add_gas if delta else None)
+    print(f"已保存 gas 费用表：{GAS_FILE} （新增 {grand_total_transfers:,} 条，共 {kept + grand_total_transfers:,} 条）")
+    if rollup:
+        with metrics.stage("rollup", incremental=delta is not None):
+            rollup.finish(delta, state, TRANSFERS_FILE, GAS_FILE)
+        rollup.close()
+    if sketches:
+        with metrics.stage("sketches", rebuild=streaming_sketches is None):
+            if streaming_sketches is None:
+                sketches.rebuild(TRANSFERS_FILE)
+            sketches.state = state
+            sketches.save(args.sketch_file)
+    if args.parquet:
+        with metrics.stage("parquet"):
+            write_parquet_dataset(TRANSFERS_FILE, TRANSFERS_PARQUET)
+            write_parquet_dataset(GAS_FILE, GAS_PARQUET)
+    save_state(state, args.state_file)
     
     # 输出统计汇总（保持原样）
     print("\n" + "="*60)
-    print("各链统计汇总：")
+    print("各链统计汇总（增量模式下仅统计本次新增）：" if args.incremental else "各链统计汇总：")
     print("-"*60)
     for s in all_stats:
         print(f"{s['chain']}:")
@@ -248,6 +838,8 @@ def main():
     print("总手续费: 详见各链统计（不同链 native token 单位不同，无法简单总和）")
     print("  ※ 手续费单位为各链 native token（如 ETH/AVAX/MATIC），非 USD。通常每笔几分钱 ~ 几美元。")
     print(f"平均单笔金额: ${(grand_total_amount / grand_total_transfers if grand_total_transfers > 0 else 0):,.2f}")
+    print(f"导出耗时: {time.monotonic() - start_time:,.1f} 秒")
+    metrics.emit("export", transfers=grand_total_transfers, seconds=round(time.monotonic() - start_time, 3))
     print("="*60)
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# ===================== 配置 =====================
+# 结构化指标：导出脚本和分析脚本把请求、分页、各阶段耗时等事件以 JSON lines 追加写入指标文件
+# （--metrics-file），每行一个事件 {"ts", "event", "pid", ...}。未配置时 emit 不做任何事，只保留内存中的计数。
+# 可选：--trace-memory 用 tracemalloc 记录每个阶段的内存分配峰值，--profile 把整个运行的 cProfile 结果写入文件
+METRICS_FILE = None
+
+class Metrics:
+    """线程安全的指标记录器：事件写入 JSON lines 文件，计数按分组累加（如按端点统计请求数、重试数、字节数）"""
+
+    def __init__(self):
+        self.file = None
+        self.trace_memory = False
+        self.profiler = None
+        self.thread_profilers = []  # 工作线程各自的 cProfile，退出时合并
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._stages = threading.local()
+        self._profiling = threading.local()
+
+    @property
+    def enabled(self):
+        return self.file is not None
+
+    def configure(self, path=METRICS_FILE, trace_memory=False, profile_path=None):
+        """打开指标文件（追加写入）；trace_memory 启动 tracemalloc；profile_path 不为 None 时对整个运行做 cProfile，
+        进程退出时写入该文件（可用 python -m pstats 或 snakeviz 查看）。cProfile 只剖析调用 enable 的线程，
+        线程池中运行的函数需用 profiled 包装"""
+        if path:
+            self.file = open(path, 'a', encoding='utf-8')
+        if trace_memory:
+            self.trace_memory = True
+            tracemalloc.start()
+        if profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            self._profiling.active = True
+        atexit.register(self.close, profile_path)
+
+    def close(self, profile_path=None):
+        if self.profiler is not None:
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler)
+            with self._lock:
+                for profiler in self.thread_profilers:
+                    stats.add(profiler)
+                self.thread_profilers = []
+            stats.dump_stats(profile_path)
+            self.profiler = None
+        if self.file is not None:
+            self.emit("counters", counters=self.counters)
+            self.file.close()
+            self.file = None
+
+    def emit(self, event, **fields):
+        if self.file is None:
+            return
+        record = {"ts": round(time.time(), 6), "event": event, "pid": os.getpid(), **fields}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def add(self, group, **values):
+        """累加分组计数，如 add(endpoint, requests=1, bytes=n)"""
+        with self._lock:
+            counters = self.counters.setdefault(group, {})
+            for key, value in values.items():
+                counters[key] = counters.get(key, 0) + value
+
+    def totals(self, group):
+        with self._lock:
+            return {key: round(value, 3) if isinstance(value, float) else value
+                    for key, value in self.counters.get(group, {}).items()}
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """记录一个阶段的耗时（及开启 trace_memory 时的内存分配峰值），结束时发出 stage 事件。
+        阶段可以嵌套：内层阶段的峰值计入外层；yield 的字典可在阶段内补充字段（如行数）"""
+        stack = self._stages.__dict__.setdefault("stack", [])
+        frame = {"peak": 0, "fields": dict(fields)}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            frame["start"] = current
+        stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield frame["fields"]
+        finally:
+            seconds = time.perf_counter() - started
+            stack.pop()
+            record = {"stage": name, "seconds": round(seconds, 6), **frame["fields"]}
+            if self.trace_memory:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+                record["peak_mb"] = round((peak - frame["start"]) / 2 ** 20, 3)
+            self.emit("stage", **record)
+
+    def profiled(self, function):
+        """装饰器：开启 --profile 时，在尚未被剖析的线程（线程池的工作线程）中调用的函数由该线程自己的 cProfile 剖析，
+        进程退出时与主线程的结果合并（pstats.Stats.add）；未开启或当前线程已在剖析时直接调用"""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if self.profiler is None or getattr(self._profiling, "active", False):
+                return function(*args, **kwargs)
+            profiler = cProfile.Profile()
+            self._profiling.active = True
+            profiler.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.disable()
+                self._profiling.active = False
+                with self._lock:
+                    self.thread_profilers.append(profiler)
+        return wrapper
+
+    def instrument(self, method):
+        """方法装饰器：每次调用作为一个阶段记录，阶段名为 类名.方法名"""
+        @functools.wraps(method)
+        def wrapper(instance, *args, **kwargs):
+            with self.stage(f"{type(instance).__name__}.{method.__name__}"):
+                return method(instance, *args, **kwargs)
+        return wrapper
+
+# 进程内共用的记录器，由各脚本的命令行参数配置
+metrics = Metrics()
@@ -0,0 +1,372 @@
+import io
+import os
+import re
+import sys
+import json
+import gzip
+import time
+import zlib
+import random
+import bisect
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.request import urlopen
+
+import numpy as np
+
+import yei_cctp_export as export
+from yei_cctp_benchmark import zipf_cdf, address_of, V2_SHARE, START_TIMESTAMP, SPAN_SECONDS
+
+# ===================== 配置 =====================
+# 本地的 Subgraph 替身：每条链一个端点 http://HOST:PORT/<链名>，提供 depositForBurns / depositForBurnV2S 两个实体，
+# 支持导出脚本用到的查询子集（别名、first、skip、orderBy、orderDirection、where 中的 id / blockTimestamp 比较条件）
+HOST = "127.0.0.1"
+PORT = 8766
+ROWS_PER_CHAIN = 20000       # 每条链生成的事件数（两个实体合计）
+MAX_FIRST = 1000             # 与 graph-node 一致：first 不能超过 1000
+MAX_SKIP = 5000              # 与 graph-node 一致：skip 不能超过 5000
+MAX_FIELDS = 0               # 单个查询最多的顶层字段数（模拟复杂度限制），0 表示不限
+LATENCY_MS = 50              # 每个请求的基础延迟
+LATENCY_PER_ROW_US = 20      # 每返回一行增加的延迟
+JITTER_MS = 20               # 延迟的随机抖动上限
+RATE_LIMIT_RPS = 0           # 每个端点的令牌桶限流（每秒请求数），0 表示不限；超出时返回 429 和 Retry-After
+RATE_LIMIT_BURST = 10
+ERROR_RATE = 0.0             # 随机返回 500 / 502 / 503 的概率
+ERROR_STATUS_CODES = [500, 502, 503]
+
+# 压测的导出策略：名称 → 导出脚本的命令行参数
+STRATEGIES = {
+    "sequential": ["--sequential"],
+    "concurrent": [],
+    "sharded": ["--shards", "8", "--shard-workers", "4"],
+    "batched": ["--shards", "8", "--batch"]
+}
+CLIENT_RPS = 50              # 压测时导出脚本的客户端限流，远高于线上默认值，以测出服务端和传输的上限
+CLIENT_BURST = 5
+
+QUERY_FIELD_RE = re.compile(r'(?:(\w+)\s*:\s*)?(\w+)\s*\(([^)]*)\)\s*\{([^}]*)\}', re.S)
+CONDITION_RE = re.compile(r'(\w+?)_(gt|gte|lt|lte)\s*:\s*"?([^",}\s]+)"?')
+
+class MockQueryError(Exception):
+    """查询不合法（如 first / skip 超限、未知实体），以 GraphQL 错误返回"""
+
+# ===================== 数据 =====================
+class EntityTable:
+    """单个实体的全部事件，按 id（即时间）排序，按列保存；id 以零填充的区块号开头，区块时间为区块号的 2 倍，
+    因此 id 顺序与 blockTimestamp 顺序一致，两种条件都可以用二分查找定位"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.ids = columns["id"]
+        self.timestamps = [int(value) for value in columns["blockTimestamp"]]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def select(self, first=100, skip=0, descending=False, conditions=(), fields=()):
+        lo, hi = 0, len(self)
+        for field, op, value in conditions:
+            if field == "id":
+                keys = self.ids
+            elif field == "blockTimestamp":
+                keys, value = self.timestamps, int(value)
+            else:
+                raise MockQueryError(f"不支持的过滤条件: {field}_{op}")
+            if op == "gt":
+                lo = max(lo, bisect.bisect_right(keys, value))
+            elif op == "gte":
+                lo = max(lo, bisect.bisect_left(keys, value))
+            elif op == "lt":
+                hi = min(hi, bisect.bisect_left(keys, value))
+            else:
+                hi = min(hi, bisect.bisect_right(keys, value))
+        if descending:
+            rows = range(hi - 1 - skip, max(lo, hi - skip - first) - 1, -1)
+        else:
+            rows = range(lo + skip, min(hi, lo + skip + first))
+        columns = [(field, self.columns[field]) for field in fields if field in self.columns]
+        return [{field: values[row] for field, values in columns} for row in rows]
+
+def generate_chain(chain_name, rows, seed=0):
+    """生成一条链的事件：{实体名: EntityTable}。按链名派生随机种子，同参数下数据固定"""
+    rng = np.random.default_rng([seed, zlib.crc32(chain_name.encode())])
+    blocks = np.sort(rng.integers(START_TIMESTAMP // 2, (START_TIMESTAMP + SPAN_SECONDS) // 2, rows))
+    cdf = zipf_cdf(max(1, rows * 2), 0.6)
+    ranks = np.minimum(np.searchsorted(cdf, rng.random(rows)), len(cdf) - 1)
+    addresses = {rank: address_of(rank) for rank in np.unique(ranks)}
+    is_v2 = rng.random(rows) < V2_SHARE
+    amounts = np.rint(np.clip(rng.lognormal(np.log(30.0), 2.5, rows), 0.01, 1e6) * 1e6).astype('int64')
+    fees = np.rint(np.clip(rng.lognormal(np.log(1e13), 3.0, (2, rows)), 0, 1.8e19)).astype('uint64')
+    hashes = rng.bytes(32 * rows).hex()
+
+    tables = {}
+    for entity, selected in (("depositForBurns", ~is_v2), ("depositForBurnV2S", is_v2)):
+        indexes = np.flatnonzero(selected)
+        columns = {
+            "id": [f"{blocks[i]:015d}:0x{hashes[i * 64:(i + 1) * 64]}:{i:010d}" for i in indexes],
+            "from": [addresses[ranks[i]] for i in indexes],
+            "amount": [str(amount) for amount in amounts[indexes]],
+            "blockTimestamp": [str(block * 2) for block in blocks[indexes]]
+        }
+        if entity == "depositForBurnV2S":
+            columns["fee"] = [str(fee) for fee in fees[0][indexes]]
+            columns["feeForgasOnDestination"] = [str(fee) for fee in fees[1][indexes]]
+        tables[entity] = EntityTable(columns)
+    return tables
+
+# ===================== 服务端 =====================
+class TokenBucket:
+    """非阻塞的令牌桶：取不到令牌时返回需要等待的秒数（作为 Retry-After）"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+class MockSubgraph:
+    """各链的数据、故障注入参数和请求统计；由 MockSubgraphHandler 调用"""
+
+    def __init__(self, chains, rows=ROWS_PER_CHAIN, seed=0, latency_ms=LATENCY_MS, latency_per_row_us=LATENCY_PER_ROW_US,
+                 jitter_ms=JITTER_MS, rate_limit_rps=RATE_LIMIT_RPS, rate_limit_burst=RATE_LIMIT_BURST,
+                 error_rate=ERROR_RATE, max_first=MAX_FIRST, max_skip=MAX_SKIP, max_fields=MAX_FIELDS):
+        self.data = {chain_name: generate_chain(chain_name, rows, seed) for chain_name in chains}
+        self.latency = latency_ms / 1000
+        self.latency_per_row = latency_per_row_us / 1e6
+        self.jitter = jitter_ms / 1000
+        self.buckets = {chain_name: TokenBucket(rate_limit_rps, rate_limit_burst) for chain_name in chains} if rate_limit_rps else {}
+        self.error_rate = error_rate
+        self.max_first = max_first
+        self.max_skip = max_skip
+        self.max_fields = max_fields
+        self.stats = {"requests": 0, "pages": 0, "rows": 0, "bytes": 0, "throttled": 0, "errors": 0, "rejected": 0}
+        self.lock = threading.Lock()
+
+    def count(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    def run_query(self, chain_name, query):
+        """执行查询，返回 (data, 页数, 行数)；不合法时抛出 MockQueryError"""
+        fields = QUERY_FIELD_RE.findall(query)
+        if self.max_fields and len(fields) > self.max_fields:
+            raise MockQueryError(f"query is too complex: {len(fields)} fields, max {self.max_fields}")
+        data, rows = {}, 0
+        for alias, entity, args, selection in fields:
+            table = self.data[chain_name].get(entity)
+            if table is None:
+                raise MockQueryError(f"Type `Query` has no field `{entity}`")
+            first = int(re.search(r'first:\s*(\d+)', args).group(1)) if 'first' in args else 100
+            skip = int(re.search(r'skip:\s*(\d+)', args).group(1)) if 'skip' in args else 0
+            if first > self.max_first:
+                raise MockQueryError(f"The `first` argument must be between 0 and {self.max_first}, but is {first}")
+            if skip > self.max_skip:
+                raise MockQueryError(f"The `skip` argument must be between 0 and {self.max_skip}, but is {skip}")
+            where = re.search(r'where:\s*\{([^}]*)\}', args)
+            conditions = CONDITION_RE.findall(where.group(1)) if where else []
+            items = table.select(first, skip, 'orderDirection: desc' in args, conditions, selection.split())
+            data[alias or entity] = items
+            rows += len(items)
+        return data, len(fields), rows
+
+class MockSubgraphHandler(BaseHTTPRequestHandler):
+    """POST /<链名> 执行 GraphQL 查询；GET /_stats 返回累计的请求统计"""
+
+    subgraph = None
+    protocol_version = "HTTP/1.1"  # 支持导出脚本的 keep-alive 连接
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/_stats":
+            return self._send(404, {"error": "not found"})
+        with self.subgraph.lock:
+            stats = dict(self.subgraph.stats)
+        self._send(200, stats)
+
+    def do_POST(self):
+        subgraph = self.subgraph
+        chain_name = self.path.strip("/")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        subgraph.count(requests=1)
+        if chain_name not in subgraph.data:
+            return self._send(404, {"error": f"unknown subgraph: {chain_name}"})
+
+        bucket = subgraph.buckets.get(chain_name)
+        retry_after = bucket.try_acquire() if bucket else 0.0
+        if retry_after:
+            subgraph.count(throttled=1)
+            return self._send(429, {"error": "rate limited"}, {"Retry-After": f"{retry_after:.3f}"})
+        if subgraph.error_rate and random.random() < subgraph.error_rate:
+            subgraph.count(errors=1)
+            return self._send(random.choice(ERROR_STATUS_CODES), {"error": "injected error"})
+
+        try:
+            data, pages, rows = subgraph.run_query(chain_name, json.loads(body)["query"])
+        except MockQueryError as e:
+            subgraph.count(rejected=1)
+            return self._send(200, {"errors": [{"message": str(e)}]})
+        time.sleep(subgraph.latency + rows * subgraph.latency_per_row + random.uniform(0, subgraph.jitter))
+        size = self._send(200, {"data": data})
+        subgraph.count(pages=pages, rows=rows, bytes=size)
+
+    def _send(self, status, body, headers=None):
+        """发送 JSON 响应（客户端接受 gzip 时压缩），返回响应体的字节数"""
+        payload = json.dumps(body).encode('utf-8')
+        compressed = "gzip" in self.headers.get("Accept-Encoding", "")
+        if compressed:
+            payload = gzip.compress(payload, compresslevel=1)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        return len(payload)
+
+def serve(options, host=HOST, port=PORT, ready=None):
+    """生成数据并启动服务；ready 不为 None 时把实际端口放入该队列（压测时以 port=0 随机分配）"""
+    MockSubgraphHandler.subgraph = MockSubgraph(list(export.CHAINS), **options)
+    server = ThreadingHTTPServer((host, port), MockSubgraphHandler)
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_address[1])
+    else:
+        print(f"模拟 Subgraph 已启动: http://{host}:{server.server_address[1]}/<链名>（{', '.join(export.CHAINS)}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# ===================== 压测 =====================
+def fetch_stats(base_url):
+    with urlopen(f"{base_url}/_stats") as response:
+        return json.load(response)
+
+def run_strategy(base_url, name, argv, client_rps=CLIENT_RPS, client_burst=CLIENT_BURST):
+    """在临时目录中用给定参数跑一次完整导出，返回耗时、吞吐和服务端统计（本次的增量）"""
+    chains = {chain_name: dict(info, endpoint=f"{base_url}/{chain_name}") for chain_name, info in export.CHAINS.items()}
+    saved = (export.CHAINS, export.RATE_LIMIT_RPS, export.RATE_LIMIT_BURST)
+    export.CHAINS, export.RATE_LIMIT_RPS, export.RATE_LIMIT_BURST = chains, client_rps, client_burst
+    export._rate_limiters.clear()
+    export._sessions.clear()
+    workdir = tempfile.mkdtemp(prefix=f"cctp_loadtest_{name}_")
+    cwd = os.getcwd()
+    before = fetch_stats(base_url)
+    started = time.perf_counter()
+    error = None
+    try:
+        os.chdir(workdir)
+        sys.argv = ["yei_cctp_export.py"] + argv
+        with redirect_stdout(io.StringIO()):
+            export.main()
+    except SystemExit as e:
+        error = f"导出中止（exit {e.code}）"
+    finally:
+        wall = time.perf_counter() - started
+        os.chdir(cwd)
+        export.CHAINS, export.RATE_LIMIT_RPS, export.RATE_LIMIT_BURST = saved
+    exported = 0
+    transfers_file = os.path.join(workdir, export.TRANSFERS_FILE)
+    if os.path.exists(transfers_file):  # 导出中止时不会写出 CSV
+        with open(transfers_file, 'rb') as f:
+            exported = max(0, sum(1 for _ in f) - 1)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    after = fetch_stats(base_url)
+    server = {key: after[key] - before[key] for key in after}
+    return {
+        "strategy": name,
+        "args": argv,
+        "error": error,
+        "wall_seconds": round(wall, 3),
+        "rows_exported": exported,
+        "pages_per_second": round(server["pages"] / wall, 2),
+        "rows_per_second": round(exported / wall, 1),
+        "server": server
+    }
+
+def print_report(results):
+    print(f"\n{'策略':<14}{'耗时(秒)':>10}{'页/秒':>10}{'行/秒':>12}{'请求':>8}{'429':>6}{'5xx':>6}{'拒绝':>6}  行数")
+    for result in results:
+        server = result["server"]
+        print(f"{result['strategy']:<14}{result['wall_seconds']:>10.2f}{result['pages_per_second']:>10.1f}"
+              f"{result['rows_per_second']:>12,.0f}{server['requests']:>8}{server['throttled']:>6}{server['errors']:>6}"
+              f"{server['rejected']:>6}  {result['rows_exported']:,}" + (f"  {result['error']}" if result['error'] else ""))
+
+def add_mock_arguments(parser):
+    parser.add_argument("--rows", type=int, default=ROWS_PER_CHAIN, help="每条链的事件数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS, help="每个请求的基础延迟（毫秒）")
+    parser.add_argument("--latency-per-row-us", type=float, default=LATENCY_PER_ROW_US, help="每行增加的延迟（微秒）")
+    parser.add_argument("--jitter-ms", type=float, default=JITTER_MS, help="随机抖动上限（毫秒）")
+    parser.add_argument("--rate-limit-rps", type=float, default=RATE_LIMIT_RPS, help="每个端点的限流（请求/秒），0 表示不限")
+    parser.add_argument("--rate-limit-burst", type=int, default=RATE_LIMIT_BURST)
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="随机返回 5xx 的概率")
+    parser.add_argument("--max-skip", type=int, default=MAX_SKIP, help="skip 参数的上限")
+    parser.add_argument("--max-fields", type=int, default=MAX_FIELDS, help="单个查询的顶层字段数上限（模拟复杂度限制），0 表示不限")
+
+def mock_options(args):
+    return {
+        "rows": args.rows, "seed": args.seed, "latency_ms": args.latency_ms, "latency_per_row_us": args.latency_per_row_us,
+        "jitter_ms": args.jitter_ms, "rate_limit_rps": args.rate_limit_rps, "rate_limit_burst": args.rate_limit_burst,
+        "error_rate": args.error_rate, "max_skip": args.max_skip, "max_fields": args.max_fields
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟 Subgraph 服务及导出脚本压测")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="启动模拟 Subgraph 服务")
+    add_mock_arguments(serve_parser)
+    serve_parser.add_argument("--host", default=HOST)
+    serve_parser.add_argument("--port", type=int, default=PORT)
+    loadtest_parser = subparsers.add_parser("loadtest", help="在独立进程中启动模拟服务，依次用各导出策略压测")
+    add_mock_arguments(loadtest_parser)
+    loadtest_parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES), choices=list(STRATEGIES))
+    loadtest_parser.add_argument("--client-rps", type=float, default=CLIENT_RPS, help="导出脚本每个端点的客户端限流")
+    loadtest_parser.add_argument("--client-burst", type=int, default=CLIENT_BURST)
+    loadtest_parser.add_argument("--output", default=None, help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(mock_options(args), args.host, args.port)
+    else:
+        # 服务端放在独立进程中，不与导出脚本的线程争用 GIL
+        ready = multiprocessing.Queue()
+        process = multiprocessing.Process(target=serve, args=(mock_options(args), HOST, 0, ready), daemon=True)
+        process.start()
+        base_url = f"http://{HOST}:{ready.get()}"
+        try:
+            results = []
+            for name in args.strategies:
+                print(f"压测 {name}: yei_cctp_export.py {' '.join(STRATEGIES[name])}")
+                results.append(run_strategy(base_url, name, STRATEGIES[name], args.client_rps, args.client_burst))
+        finally:
+            process.terminate()
+        print_report(results)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({"mock": mock_options(args), "client_rps": args.client_rps, "results": results},
+                          f, indent=2, ensure_ascii=False)
+            print(f"\n已保存压测结果: {args.output}")
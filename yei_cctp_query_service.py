@@ -0,0 +1,292 @@
+import re
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from yei_cctp_analysis import (CCTPAnalyzer, ADDRESS_TABLE_FILE, MISSING_ADDRESS, TIME_GRANULARITIES, time_buckets,
+                               bucket_labels, table_columns)
+
+
+# ===================== 配置 =====================
+HOST = "127.0.0.1"
+PORT = 8765
+DEFAULT_LIMIT = 100     # 地址历史默认返回的条数
+MAX_LIMIT = 10000
+DEFAULT_TOP_N = 10
+ADDRESS_PATTERN = re.compile(r"^0x[0-9a-fA-F]{40}$")
+
+
+class QueryError(Exception):
+    """查询参数错误，返回 400"""
+
+
+def parse_time(value):
+    """时间参数：Unix 秒，或 ISO 日期 / 时间（按 UTC 解释）"""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise QueryError(f"无法解析的时间: {value}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def parse_limit(value, default):
+    """数量参数（limit / n）：正整数，超过 MAX_LIMIT 时截断"""
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise QueryError(f"无效的数量: {value}")
+    if limit < 1:
+        raise QueryError(f"数量必须是正整数: {value}")
+    return min(limit, MAX_LIMIT)
+
+
+def sender_totals(senders, micros):
+    """按地址 ID 汇总转账次数和金额（排序后分段求和，金额为 1e-6 USD 的整数，结果精确）。
+    返回 (地址 ID, 次数, 金额) 三个数组，地址 ID 升序；数组大小只与出现的地址数有关。
+    缺少 from 的行（MISSING_ADDRESS）不计入"""
+    present = senders != MISSING_ADDRESS
+    senders, micros = senders[present], micros[present]
+    order = np.argsort(senders, kind='stable')
+    ids, starts, counts = np.unique(senders[order], return_index=True, return_counts=True)
+    sums = np.add.reduceat(micros[order], starts) if len(ids) else np.empty(0, dtype='int64')
+    return ids, counts, sums
+
+
+def rank_senders(ids, values):
+    """按 values 降序、地址 ID 升序排列的下标"""
+    return np.lexsort((ids, -values))
+
+
+class TransferIndex:
+    """常驻内存的转账索引：按 (地址, 时间)、(链, 时间)、时间 三种顺序排列的行号，以及对应顺序的金额前缀和。
+    地址 / 链 / 时间范围的定位只需几次二分查找，区间次数和金额由前缀和相减得到，无需扫描；
+    不限时间的头部地址查询（全部链及每条链）使用预先汇总的各地址合计"""
+
+    def __init__(self, analyzer):
+        df = analyzer.transfers_df
+        self.addresses = analyzer.addresses
+        self.chains = list(df['chain'].cat.categories)
+        self.chain_codes = df['chain'].cat.codes.to_numpy()
+        self.types = df['type'].astype(str).to_numpy()
+        self.timestamps = df['blockTimestamp'].to_numpy()
+        self.micros = df['amount'].to_numpy()
+        self.senders = df['from'].to_numpy() if 'from' in df.columns else None
+
+        self.by_time = np.argsort(self.timestamps, kind='stable')
+        self.by_chain = np.lexsort((self.timestamps, self.chain_codes))
+        self.time_prefix = self._prefix(self.by_time)
+        self.chain_prefix = self._prefix(self.by_chain)
+        self.sorted_chains = self.chain_codes[self.by_chain]
+        # 各排列下的时间戳，二分查找时间范围时直接使用，不必按行号取值
+        self.sorted_times = {"time": self.timestamps[self.by_time], "chain": self.timestamps[self.by_chain]}
+        if self.senders is not None:
+            self.by_sender = np.lexsort((self.timestamps, self.senders))
+            self.sorted_senders = self.senders[self.by_sender]
+            self.sorted_times["sender"] = self.timestamps[self.by_sender]
+            # {链编码（None 为全部链）: sender_totals 的结果}，以及按次数、按金额的排名
+            self.sender_totals = {None: sender_totals(self.senders, self.micros)}
+            for code in range(len(self.chains)):
+                rows = self.by_chain[np.searchsorted(self.sorted_chains, code, 'left'):
+                                     np.searchsorted(self.sorted_chains, code, 'right')]
+                self.sender_totals[code] = sender_totals(self.senders[rows], self.micros[rows])
+            self.sender_rankings = {
+                key: {"count": rank_senders(ids, counts), "amount": rank_senders(ids, sums)}
+                for key, (ids, counts, sums) in self.sender_totals.items()
+            }
+
+    def _prefix(self, order):
+        return np.concatenate([[0], np.cumsum(self.micros[order])])
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _chain_code(self, chain):
+        if chain not in self.chains:
+            raise QueryError(f"未知的链: {chain}，可选: {', '.join(self.chains)}")
+        return self.chains.index(chain)
+
+    def _time_slice(self, ordering, lo, hi, start, end):
+        """在某一排列的 [lo, hi)（其中时间戳有序）内定位 [start, end) 的下标范围"""
+        timestamps = self.sorted_times[ordering][lo:hi]
+        first = np.searchsorted(timestamps, start, 'left') if start is not None else 0
+        last = np.searchsorted(timestamps, end, 'left') if end is not None else len(timestamps)
+        return lo + first, lo + max(first, last)
+
+    def range(self, chain=None, start=None, end=None):
+        """返回 (行号排列, 前缀和, lo, hi)：行号排列[lo:hi] 即满足条件的行，均按时间排序"""
+        if chain is None:
+            lo, hi = self._time_slice("time", 0, len(self), start, end)
+            return self.by_time, self.time_prefix, lo, hi
+        code = self._chain_code(chain)
+        lo = np.searchsorted(self.sorted_chains, code, 'left')
+        hi = np.searchsorted(self.sorted_chains, code, 'right')
+        lo, hi = self._time_slice("chain", lo, hi, start, end)
+        return self.by_chain, self.chain_prefix, lo, hi
+
+    def aggregate(self, chain=None, start=None, end=None, granularity=None):
+        """时间范围内的转账次数和金额；指定 granularity 时附带按时间桶的明细"""
+        order, prefix, lo, hi = self.range(chain, start, end)
+        count = int(hi - lo)
+        total = int(prefix[hi] - prefix[lo])
+        result = {
+            "chain": chain,
+            "start": start,
+            "end": end,
+            "transfer_count": count,
+            "total_amount_usd": total / 1e6,
+            "average_amount_usd": total / 1e6 / count if count else 0.0
+        }
+        if granularity is not None:
+            if granularity not in TIME_GRANULARITIES:
+                raise QueryError(f"未知的时间粒度: {granularity}，可选: {', '.join(TIME_GRANULARITIES)}")
+            # 行已按时间排序，同一时间桶的行相邻，用 reduceat 分段求和
+            keys = time_buckets(self.timestamps[order[lo:hi]], granularity)
+            buckets, starts = np.unique(keys, return_index=True)
+            counts = np.diff(np.append(starts, len(keys)))
+            sums = np.add.reduceat(self.micros[order[lo:hi]], starts) if len(keys) else np.empty(0, dtype='int64')
+            result["buckets"] = [
+                {"bucket": label, "transfer_count": int(n), "total_amount_usd": int(amount) / 1e6}
+                for label, n, amount in zip(bucket_labels(buckets, granularity), counts, sums)
+            ]
+        return result
+
+    def address_history(self, address, chain=None, start=None, end=None, limit=DEFAULT_LIMIT):
+        """单个地址在时间范围内的转账明细（最新的在前，最多 limit 条）及合计"""
+        if self.senders is None:
+            raise QueryError("数据中缺少用户地址信息")
+        if not ADDRESS_PATTERN.match(address):
+            raise QueryError(f"无效的地址: {address}")
+        address_id = self.addresses.lookup(address)
+        rows = np.empty(0, dtype='int64')
+        if address_id is not None:
+            lo = np.searchsorted(self.sorted_senders, address_id, 'left')
+            hi = np.searchsorted(self.sorted_senders, address_id, 'right')
+            lo, hi = self._time_slice("sender", lo, hi, start, end)
+            rows = self.by_sender[lo:hi]
+            if chain is not None:
+                rows = rows[self.chain_codes[rows] == self._chain_code(chain)]
+
+        total = int(self.micros[rows].sum())
+        return {
+            "address": address.lower(),
+            "chain": chain,
+            "start": start,
+            "end": end,
+            "transfer_count": len(rows),
+            "total_amount_usd": total / 1e6,
+            "transfers": [
+                {
+                    "chain": self.chains[self.chain_codes[row]],
+                    "type": self.types[row],
+                    "amount_usd": int(self.micros[row]) / 1e6,
+                    "blockTimestamp": int(self.timestamps[row])
+                }
+                for row in rows[::-1][:limit]
+            ]
+        }
+
+    def top_senders(self, n=DEFAULT_TOP_N, by='count', chain=None, start=None, end=None):
+        """时间范围内转账次数或金额最多的前 n 个地址；不限时间时直接使用预先汇总的合计，否则只汇总范围内的行"""
+        if self.senders is None:
+            raise QueryError("数据中缺少用户地址信息")
+        if by not in ('count', 'amount'):
+            raise QueryError("by 只能是 count 或 amount")
+        if start is None and end is None:
+            key = None if chain is None else self._chain_code(chain)
+            ids, counts, sums = self.sender_totals[key]
+            top = self.sender_rankings[key][by][:n]
+        else:
+            order, _, lo, hi = self.range(chain, start, end)
+            rows = order[lo:hi]
+            ids, counts, sums = sender_totals(self.senders[rows], self.micros[rows])
+            top = rank_senders(ids, counts if by == 'count' else sums)[:n]
+        return {
+            "by": by,
+            "chain": chain,
+            "start": start,
+            "end": end,
+            "senders": [
+                {"address": address, "transfer_count": int(counts[i]), "total_amount_usd": int(sums[i]) / 1e6}
+                for address, i in zip(self.addresses.decode(ids[top]), top)
+            ]
+        }
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """GET 接口，返回 JSON：
+    /aggregate?chain=ARB&start=2025-01-01&end=2025-02-01&granularity=day
+    /address/<0x地址>?chain=ARB&start=...&end=...&limit=100
+    /top?by=count|amount&n=10&chain=...&start=...&end=..."""
+
+    index = None
+
+    def do_GET(self):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        try:
+            filters = {
+                "chain": params.get("chain"),
+                "start": parse_time(params.get("start")),
+                "end": parse_time(params.get("end"))
+            }
+            if parts == ['aggregate']:
+                result = self.index.aggregate(granularity=params.get("granularity"), **filters)
+            elif len(parts) == 2 and parts[0] == 'address':
+                limit = parse_limit(params.get("limit"), DEFAULT_LIMIT)
+                result = self.index.address_history(parts[1], limit=limit, **filters)
+            elif parts == ['top']:
+                n = parse_limit(params.get("n"), DEFAULT_TOP_N)
+                result = self.index.top_senders(n, params.get("by", "count"), **filters)
+            else:
+                return self._send(404, {"error": f"未知的路径: {url.path}"})
+        except (QueryError, ValueError) as e:
+            return self._send(400, {"error": str(e)})
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        self._send(200, result)
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻内存的 CCTP 转账查询服务")
+    parser.add_argument("--transfers-file", default="all_chains_transfers.csv",
+                        help="转账主表（CSV 或 Parquet 数据集）")
+    parser.add_argument("--gas-file", default="all_chains_gas.csv", help="手续费表（CSV 或 Parquet 数据集）")
+    parser.add_argument("--address-table", default=ADDRESS_TABLE_FILE, help="持久化的地址字典文件")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    # 一次性加载转账表（不读取 gas 表）并建立索引，之后的查询都在内存中完成
+    analyzer = CCTPAnalyzer(args.transfers_file, args.gas_file, address_table=args.address_table, lazy=True)
+    analyzer.require('transfers', table_columns('transfers'))
+    QueryHandler.index = TransferIndex(analyzer)
+    print(f"已建立索引: {len(QueryHandler.index):,} 条转账")
+
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    print(f"查询服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("查询服务已停止")
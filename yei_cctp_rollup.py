@@ -0,0 +1,142 @@
+import csv
+import json
+import sqlite3
+
+# ===================== 配置 =====================
+# 预聚合汇总库：按 链 × 天 × 发送地址 累计转账次数和金额，按 链 × native_symbol × 天 累计手续费。
+# 由导出脚本（--rollup）在每次导出后增量更新，分析脚本（--rollup-file）直接从中出报表，不再扫描原始数据
+ROLLUP_FILE = "cctp_rollup.db"
+SCHEMA_VERSION = "2"     # 表结构版本，与库中记录的不同时（如旧版按 1e-12 native 累计手续费的库）删表重建
+SECONDS_PER_DAY = 86400
+AMOUNT_SCALE = 10 ** 6   # 金额按 1e-6 USD 的整数累计（USDC 精度，即 Subgraph 的 amount 原值）
+# 手续费按 native token 最小单位（10^-decimals）的整数累计。18 位精度的合计可能超出 int64，
+# 因此拆成 高位（÷FEE_SPLIT）和 低位 两列分别累加，读出时再合成
+FEE_SPLIT = 10 ** 9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfer_rollup (
+    chain TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    transfer_count INTEGER NOT NULL,
+    amount_micros INTEGER NOT NULL,
+    PRIMARY KEY (chain, day, sender)
+);
+CREATE TABLE IF NOT EXISTS fee_rollup (
+    chain TEXT NOT NULL,
+    native_symbol TEXT NOT NULL,
+    decimals INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    fee_count INTEGER NOT NULL,
+    fee_hi INTEGER NOT NULL,
+    fee_lo INTEGER NOT NULL,
+    fee_gas_hi INTEGER NOT NULL,
+    fee_gas_lo INTEGER NOT NULL,
+    PRIMARY KEY (chain, native_symbol, decimals, day)
+);
+CREATE TABLE IF NOT EXISTS rollup_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+TRANSFER_UPSERT = """
+INSERT INTO transfer_rollup (chain, day, sender, transfer_count, amount_micros) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (chain, day, sender) DO UPDATE SET
+    transfer_count = transfer_count + excluded.transfer_count,
+    amount_micros = amount_micros + excluded.amount_micros
+"""
+
+FEE_UPSERT = """
+INSERT INTO fee_rollup (chain, native_symbol, decimals, day, fee_count, fee_hi, fee_lo, fee_gas_hi, fee_gas_lo)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (chain, native_symbol, decimals, day) DO UPDATE SET
+    fee_count = fee_count + excluded.fee_count,
+    fee_hi = fee_hi + excluded.fee_hi,
+    fee_lo = fee_lo + excluded.fee_lo,
+    fee_gas_hi = fee_gas_hi + excluded.fee_gas_hi,
+    fee_gas_lo = fee_gas_lo + excluded.fee_gas_lo
+"""
+
+class RollupDelta:
+    """一批 CSV 行对汇总表的增量，在内存中按汇总键累计；sign 为 1 表示新增的行，-1 表示被覆盖删除的行。
+    行中的 amount / fee / fee_gas 为整数（最小单位），直接按 Python 整数累加，没有舍入"""
+
+    def __init__(self):
+        self.transfers = {}  # {(chain, day, sender): [次数, 金额]}
+        self.fees = {}       # {(chain, native_symbol, decimals, day): [次数, fee, gas]}
+
+    def add_transfer(self, row, sign=1):
+        key = (row["chain"], int(row["blockTimestamp"]) // SECONDS_PER_DAY, row.get("from") or "")
+        totals = self.transfers.setdefault(key, [0, 0])
+        totals[0] += sign
+        totals[1] += sign * int(row["amount"])
+
+    def add_gas(self, row, sign=1):
+        key = (row["chain"], row["native_symbol"], int(row["decimals"]), int(row["blockTimestamp"]) // SECONDS_PER_DAY)
+        totals = self.fees.setdefault(key, [0, 0, 0])
+        totals[0] += sign
+        totals[1] += sign * int(row["fee"])
+        totals[2] += sign * int(row["fee_gas"])
+
+class RollupStore:
+    """SQLite 汇总库。记录它对应的导出水位：只有水位与本次导出的起点一致时才做增量更新，
+    否则（首次使用、全量导出、上次中途失败）在导出完成后由 CSV 整体重建"""
+
+    def __init__(self, path=ROLLUP_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        if self._meta("schema_version") != SCHEMA_VERSION:
+            # 旧版结构的库：删表重建，水位随之清空，本次导出后由 CSV 整体重建
+            self.connection.executescript("DROP TABLE transfer_rollup; DROP TABLE fee_rollup; DROP TABLE rollup_meta;" + SCHEMA)
+            with self.connection:
+                self.connection.execute("INSERT INTO rollup_meta (key, value) VALUES ('schema_version', ?)", (SCHEMA_VERSION,))
+
+    def close(self):
+        self.connection.close()
+
+    def _meta(self, key):
+        row = self.connection.execute("SELECT value FROM rollup_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def state(self):
+        value = self._meta("state")
+        return json.loads(value) if value is not None else None
+
+    def _set_state(self, state):
+        value = json.dumps(state, sort_keys=True) if state is not None else None
+        self.connection.execute("INSERT OR REPLACE INTO rollup_meta (key, value) VALUES ('state', ?)", (value,))
+
+    def begin(self, start_state):
+        """导出合并 CSV 之前调用。汇总库与起点水位一致时返回一个 RollupDelta 用于收集增量，否则返回 None。
+        同时把汇总库标记为未完成，合并或更新中途失败时下次会整体重建"""
+        incremental = start_state is not None and self.state() == start_state
+        with self.connection:
+            self._set_state(None)
+        return RollupDelta() if incremental else None
+
+    def finish(self, delta, state, transfers_file, gas_file):
+        """CSV 合并完成后调用：应用增量（delta 为 None 时由合并后的 CSV 重建），并记录新的水位"""
+        with self.connection:
+            if delta is None:
+                delta = RollupDelta()
+                with open(transfers_file, 'r', newline='', encoding='utf-8') as f:
+                    for row in csv.DictReader(f):
+                        delta.add_transfer(row)
+                with open(gas_file, 'r', newline='', encoding='utf-8') as f:
+                    for row in csv.DictReader(f):
+                        delta.add_gas(row)
+                self.connection.execute("DELETE FROM transfer_rollup")
+                self.connection.execute("DELETE FROM fee_rollup")
+            self._apply(delta)
+            self._set_state(state)
+        print(f"已更新汇总库：{self.path} （{len(delta.transfers):,} 个 链×天×地址 分组变动）")
+
+    def _apply(self, delta):
+        self.connection.executemany(TRANSFER_UPSERT, (key + tuple(totals) for key, totals in delta.transfers.items()))
+        self.connection.executemany(FEE_UPSERT, (key + (count,) + divmod(fee, FEE_SPLIT) + divmod(gas, FEE_SPLIT)
+                                                 for key, (count, fee, gas) in delta.fees.items()))
+        # 被覆盖的行全部删掉后，分组计数归零
+        self.connection.execute("DELETE FROM transfer_rollup WHERE transfer_count = 0")
+        self.connection.execute("DELETE FROM fee_rollup WHERE fee_count = 0")
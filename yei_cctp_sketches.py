@@ -0,0 +1,226 @@
+import base64
+import csv
+import hashlib
+import json
+import math
+import os
+import threading
+import zlib
+from datetime import datetime, timezone
+from yei_cctp_rollup import SECONDS_PER_DAY, AMOUNT_SCALE
+
+# ===================== 配置 =====================
+# 近似用户指标：按 (链, 天) 维护去重地址数（HyperLogLog）和按次数 / 按金额的头部地址（Space-Saving），
+# 导出脚本（--sketches）随页流式更新，内存与数据量无关，只与 (链, 天) 的数量和下面两个精度参数有关
+SKETCH_FILE = "cctp_sketches.json"
+HLL_PRECISION = 12     # 2^12 个寄存器，去重计数的相对标准误差约 1.04 / sqrt(4096) ≈ 1.6%
+TOP_K_CAPACITY = 64    # 每个 Space-Saving 摘要跟踪的地址数，单个地址的高估不超过 总量 / 容量
+
+def hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class HyperLogLog:
+    """HyperLogLog 去重计数：2^precision 个单字节寄存器，按寄存器取最大值即可合并"""
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    def add(self, value):
+        h = hash64(value)
+        width = 64 - self.precision
+        index = h >> width
+        rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    @classmethod
+    def union(cls, sketches, precision=HLL_PRECISION):
+        """多个草图的并集：逐寄存器取最大值（一次 map 处理所有草图，比两两合并快得多）"""
+        registers = [sketch.registers for sketch in sketches]
+        if not registers:
+            return cls(precision)
+        return cls(precision, bytearray(map(max, *registers)) if len(registers) > 1 else bytearray(registers[0]))
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 小基数时改用线性计数
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def to_json(self):
+        return base64.b64encode(zlib.compress(bytes(self.registers))).decode('ascii')
+
+    @classmethod
+    def from_json(cls, data, precision):
+        return cls(precision, bytearray(zlib.decompress(base64.b64decode(data))))
+
+class SpaceSaving:
+    """Space-Saving 头部元素摘要：最多跟踪 capacity 个元素。每个元素记录 [估计值, 最大高估]，
+    真实值落在 [估计值 - 最大高估, 估计值] 之间；未被跟踪的元素真实值不超过 floor()"""
+
+    def __init__(self, capacity=TOP_K_CAPACITY, counters=None, total=0):
+        self.capacity = capacity
+        self.counters = counters if counters is not None else {}  # {元素: [估计值, 最大高估]}
+        self.total = total
+
+    def add(self, item, weight=1):
+        self.total += weight
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0]
+        else:
+            # 替换估计值最小的元素，新元素继承它的计数作为高估上限
+            victim = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[item] = [floor + weight, floor]
+
+    def floor(self):
+        """未被跟踪的元素真实值的上限：摘要已满时为最小估计值，否则为 0"""
+        return min(counter[0] for counter in self.counters.values()) if len(self.counters) >= self.capacity else 0
+
+    @staticmethod
+    def combine(summaries):
+        """合并多个摘要（如多天、多条链）：估计值为各摘要中跟踪到的计数之和；
+        真实值下界为估计值减去各自的最大高估，上界为估计值加上未跟踪该元素的摘要的 floor。
+        返回按估计值降序的 [(元素, 估计值, 下界, 上界)] 和总量"""
+        combined = {}  # {元素: [估计值之和, 高估之和, 跟踪到它的摘要的 floor 之和]}
+        floor_total = 0
+        total = 0
+        for summary in summaries:
+            floor = summary.floor()
+            floor_total += floor
+            total += summary.total
+            for item, (estimate, error) in summary.counters.items():
+                entry = combined.setdefault(item, [0, 0, 0])
+                entry[0] += estimate
+                entry[1] += error
+                entry[2] += floor
+        ranked = sorted(combined.items(), key=lambda entry: (-entry[1][0], entry[0]))
+        return [(item, estimate, estimate - error, estimate + floor_total - tracked_floor)
+                for item, (estimate, error, tracked_floor) in ranked], total
+
+    def to_json(self):
+        return {"total": self.total, "counters": [[item] + counter for item, counter in self.counters.items()]}
+
+    @classmethod
+    def from_json(cls, data, capacity):
+        return cls(capacity, {item: [estimate, error] for item, estimate, error in data["counters"]}, data["total"])
+
+class SketchStore:
+    """按 (链, 天) 保存的草图集合。state 为草图对应的导出水位：与下一次增量导出的起点一致时随页流式更新，
+    否则导出后由合并的 CSV 重建（Space-Saving 不能撤销，不能重复计入被覆盖的行）"""
+
+    def __init__(self, precision=HLL_PRECISION, capacity=TOP_K_CAPACITY):
+        self.precision = precision
+        self.capacity = capacity
+        self.cells = {}  # {(chain, day): {"users": HyperLogLog, "by_count": SpaceSaving, "by_amount": SpaceSaving}}
+        self.state = None
+        self._lock = threading.Lock()
+
+    def _cell(self, chain, day):
+        cell = self.cells.get((chain, day))
+        if cell is None:
+            cell = self.cells[(chain, day)] = {
+                "users": HyperLogLog(self.precision),
+                "by_count": SpaceSaving(self.capacity),
+                "by_amount": SpaceSaving(self.capacity)
+            }
+        return cell
+
+    def add_records(self, transfers):
+        """计入一批转账记录（导出脚本的一页，或 CSV 行）；各窗口线程共用同一个草图集合"""
+        with self._lock:
+            for transfer in transfers:
+                address = transfer.get("from")
+                if not address:
+                    continue
+                cell = self._cell(transfer["chain"], int(transfer["blockTimestamp"]) // SECONDS_PER_DAY)
+                cell["users"].add(address)
+                cell["by_count"].add(address)
+                cell["by_amount"].add(address, int(transfer["amount"]))
+
+    def rebuild(self, transfers_file):
+        """丢弃现有草图，由完整的转账 CSV 重新计算"""
+        self.cells = {}
+        with open(transfers_file, 'r', newline='', encoding='utf-8') as f:
+            self.add_records(csv.DictReader(f))
+
+    def _select(self, chain=None, start_day=None, end_day=None):
+        for (cell_chain, day), cell in self.cells.items():
+            if chain is not None and cell_chain != chain:
+                continue
+            if (start_day is not None and day < start_day) or (end_day is not None and day >= end_day):
+                continue
+            yield cell
+
+    def distinct_users(self, chain=None, start_day=None, end_day=None):
+        """去重地址数的估计值和相对标准误差；天为 1970-01-01 起的天数，end_day 不包含"""
+        merged = HyperLogLog.union((cell["users"] for cell in self._select(chain, start_day, end_day)), self.precision)
+        return merged.count(), merged.relative_error
+
+    def top_senders(self, n=10, by="count", chain=None, start_day=None, end_day=None):
+        """按次数（by="count"）或金额（by="amount"）估计的头部地址：[(地址, 估计值, 下界, 上界)]，金额单位为 USD"""
+        ranked, _ = SpaceSaving.combine(cell["by_" + by] for cell in self._select(chain, start_day, end_day))
+        scale = 1 if by == "count" else AMOUNT_SCALE
+        return [(address, estimate / scale, lower / scale, upper / scale) for address, estimate, lower, upper in ranked[:n]]
+
+    def watermark(self):
+        """草图对应的各链最新事件时间 {链名: UTC 时间字符串}，由 state 中各实体的 blockTimestamp 取最大值"""
+        marks = {}
+        for chain, entities in (self.state or {}).items():
+            timestamps = [int(mark["blockTimestamp"]) for mark in entities.values() if mark.get("blockTimestamp")]
+            if timestamps:
+                marks[chain] = datetime.fromtimestamp(max(timestamps), timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        return marks
+
+    def save(self, path=SKETCH_FILE):
+        data = {
+            "precision": self.precision,
+            "capacity": self.capacity,
+            "state": self.state,
+            "cells": [
+                {
+                    "chain": chain,
+                    "day": day,
+                    "users": cell["users"].to_json(),
+                    "by_count": cell["by_count"].to_json(),
+                    "by_amount": cell["by_amount"].to_json()
+                }
+                for (chain, day), cell in sorted(self.cells.items())
+            ]
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        print(f"已保存草图：{path} （{len(self.cells):,} 个 链×天）")
+
+    @classmethod
+    def load(cls, path=SKETCH_FILE, precision=None, capacity=None):
+        """读取草图文件；文件不存在或精度参数与要求不同时返回空的草图集合（state 为 None，导出后会重建）"""
+        if not os.path.exists(path):
+            return cls(precision or HLL_PRECISION, capacity or TOP_K_CAPACITY)
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if (precision or data["precision"]) != data["precision"] or (capacity or data["capacity"]) != data["capacity"]:
+            return cls(precision, capacity)
+        store = cls(data["precision"], data["capacity"])
+        store.state = data["state"]
+        for cell in data["cells"]:
+            store.cells[(cell["chain"], cell["day"])] = {
+                "users": HyperLogLog.from_json(cell["users"], store.precision),
+                "by_count": SpaceSaving.from_json(cell["by_count"], store.capacity),
+                "by_amount": SpaceSaving.from_json(cell["by_amount"], store.capacity)
+            }
+        return store